@@ -0,0 +1,68 @@
+"""
+Compares the native rate preprocessing order with the resample-first order (decode_sr).
+
+    python -m benchmarks.resample_first -v ./converted_video/episode.mp3 -a ./audio/song1.mp3 ./audio/song2.mp3
+
+Reports the preprocessing time of both orders, the speedup, the correlation of the extracted
+features, and the agreement (Jaccard index of matched seconds) of the matching results.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from modules.analyze.feature import FeatureManager
+from modules.analyze.matching import MatchingManager
+from modules.analyze.preprocess import PreprocessManager
+
+from .utils import agreement
+
+
+def extract(path, mode, sr, decode_sr):
+    st = time.process_time()
+    y, _ = PreprocessManager(mode, sr=sr, decode_sr=decode_sr).run(path)
+    preprocess_time = time.process_time() - st
+    features, hopped_sr = FeatureManager(FeatureManager.ModeEnum.SPECTRAL, sr=sr).run(y)
+    return features, hopped_sr, preprocess_time
+
+
+def feature_correlation(a, b):
+    frames = min(a.shape[1], b.shape[1])
+    return float(np.corrcoef(a[:, :frames].ravel(), b[:, :frames].ravel())[0, 1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resample-first preprocessing benchmark')
+    parser.add_argument('-v', '--video', required=True, help='Converted episode audio')
+    parser.add_argument('-a', '--audio', nargs='+', required=True, help='Songs to match against the episode')
+    parser.add_argument('-sr', '--samplingrate', type=int, default=2048)
+    parser.add_argument('-dsr', '--decodesr', type=int, nargs='+', default=[2048, 8192],
+                        help='Decode rates to compare against the native rate order')
+    parser.add_argument('-pm', '--preprocessmode', type=int, default=PreprocessManager.ModeEnum.SPECTRAL,
+                        choices=[PreprocessManager.ModeEnum.BASIC, PreprocessManager.ModeEnum.SPECTRAL],
+                        help='Preprocessor mode. Only 1 and 2 have a resample-first order, 3 streams at the source rate')
+    parser.add_argument('-mo', '--matchermode', type=int, default=MatchingManager.ModeEnum.MULTV)
+    parser.add_argument('-th', '--threshold', type=float, default=20)
+    args = parser.parse_args()
+
+    files = [args.video] + args.audio
+    native = {path: extract(path, args.preprocessmode, args.samplingrate, None) for path in files}
+    native_time = sum(t for _, _, t in native.values())
+
+    def match(features, audio_path):
+        video_features, video_sr, _ = features[args.video]
+        matcher = MatchingManager(args.matchermode, sr=video_sr, th=args.threshold)
+        return matcher.run(video_features, features[audio_path][0])[1]
+
+    native_segments = {audio_path: match(native, audio_path) for audio_path in args.audio}
+
+    print(f"native order: preprocessing {native_time:.2f} CPU-s")
+    for decode_sr in args.decodesr:
+        reduced = {path: extract(path, args.preprocessmode, args.samplingrate, decode_sr) for path in files}
+        reduced_time = sum(t for _, _, t in reduced.values())
+        correlations = [feature_correlation(native[path][0], reduced[path][0]) for path in files]
+        agreements = [agreement(native_segments[audio_path], match(reduced, audio_path)) for audio_path in args.audio]
+        print(f"decode_sr={decode_sr}: preprocessing {reduced_time:.2f} CPU-s, "
+              f"speedup x{native_time / max(reduced_time, 1e-9):.1f}, "
+              f"feature correlation {np.mean(correlations):.4f} (min {np.min(correlations):.4f}), "
+              f"match agreement {np.mean(agreements):.3f} (min {np.min(agreements):.3f})")
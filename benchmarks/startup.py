@@ -0,0 +1,79 @@
+"""
+Startup time of main.py and of the matching worker pool.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup -r 10 -p 4 -sm fork forkserver
+
+Cold starts: wall time of `main.py --help`, `main.py -c` and `main.py -m` in fresh interpreters, run in an
+empty working folder so only imports and setup are measured.
+Worker pool: for every start method, the wall time until each of `p` workers finished its first feature
+extraction (imports, librosa filterbanks and JIT compilation included), and the slowest first extraction.
+Run it from the repository root, like main.py, so forkserver workers can import the package.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+COMMANDS = {'help': ['--help'], 'convert': ['-c'], 'match': ['-m']}
+
+
+def cold_start(arguments, folder):
+    st = time.perf_counter()
+    subprocess.run([sys.executable, MAIN, *arguments], cwd=folder, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - st
+
+
+def first_extraction(sr):
+    """
+    Pool task: one SPECTRAL feature extraction of 4 seconds of noise.
+    :return: its wall time
+    """
+    st = time.perf_counter()
+    import numpy as np
+    from modules.analyze.feature import FeatureManager
+
+    y = np.random.default_rng(0).standard_normal(sr * 4).astype(np.float32)
+    FeatureManager(FeatureManager.ModeEnum.SPECTRAL, sr=sr).run(y)
+    return time.perf_counter() - st
+
+
+def pool_startup(start_method, processes, sr):
+    """
+    :return: wall time until every worker finished its first extraction, slowest first extraction
+    """
+    from modules.analyze import VideoAudioMatchRunner
+
+    runner = VideoAudioMatchRunner('.', '.', '.', sr, start_method=start_method)
+    st = time.perf_counter()
+    with runner._executor(processes) as pool:
+        first = pool.map(first_extraction, [sr] * processes, chunksize=1)
+    return time.perf_counter() - st, max(first)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Startup time benchmark')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Cold starts per command')
+    parser.add_argument('-p', '--processes', type=int, default=2, help='Workers of the pool measurements')
+    parser.add_argument('-sm', '--startmethod', nargs='+', default=['fork', 'spawn', 'forkserver'])
+    parser.add_argument('-sr', '--samplingrate', type=int, default=2048)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='where-is-the-song-startup-') as folder:
+        for name in ('video', 'converted_video', 'audio'):
+            os.makedirs(os.path.join(folder, name))
+        for name, arguments in COMMANDS.items():
+            times = [cold_start(arguments, folder) for _ in range(args.repeat)]
+            print(f"main.py {' '.join(arguments):<7} cold start: median {statistics.median(times):.3f}s, "
+                  f"min {min(times):.3f}s over {args.repeat} runs")
+
+    # every start method in this process, fork first so the others cannot leave anything to inherit
+    for start_method in sorted(args.startmethod, key=lambda method: method != 'fork'):
+        ready, first = pool_startup(start_method, args.processes, args.samplingrate)
+        print(f"{start_method:<10} pool of {args.processes}: every worker done with its first extraction after "
+              f"{ready:.3f}s, slowest first extraction {first:.3f}s")
@@ -0,0 +1,58 @@
+"""
+Checks that stream mode (-st) reports the same matches as the two phase run, on a generated synthetic dataset.
+
+    python -m benchmarks.stream
+    python -m benchmarks.stream -mo 5 -th 3 -e 2 -s 4
+
+Episodes are the longest files, so they are extracted first and every song finishes after its episodes,
+each song then submitting matching tasks of its own for episodes that already have some.
+Exits with status 1 if any report differs.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+from modules.analyze import VideoAudioMatchRunner
+
+from .synthetic import generate_dataset
+
+
+def read_reports(results_folder):
+    """
+    :return: {report name: sorted (audio, segments) entries}, independent of the order songs finished in
+    """
+    reports = {}
+    for name in sorted(os.listdir(results_folder)):
+        if name.endswith('_report.txt'):
+            with open(os.path.join(results_folder, name)) as f:
+                reports[name] = sorted(entry for entry in f.read().split('\n\n') if entry.strip())
+    return reports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream mode consistency check')
+    parser.add_argument('-mo', '--matchermode', type=int, default=5)
+    parser.add_argument('-th', '--threshold', type=float, default=3)
+    parser.add_argument('-sr', '--samplingrate', type=int, default=2048)
+    parser.add_argument('-e', '--episodes', type=int, default=2)
+    parser.add_argument('-d', '--duration', type=float, default=300, help='Episode duration in seconds')
+    parser.add_argument('-s', '--songs', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='where-is-the-song-stream-') as folder:
+        generate_dataset(folder, args.episodes, args.duration, args.songs, seed=args.seed)
+        reports = {}
+        for stream in (False, True):
+            results_folder = os.path.join(folder, 'results_stream' if stream else 'results')
+            VideoAudioMatchRunner(os.path.join(folder, 'episodes'), os.path.join(folder, 'songs'), results_folder,
+                                  args.samplingrate, args.threshold, args.matchermode, stream=stream).run()
+            reports[stream] = read_reports(results_folder)
+
+    differing = sorted(name for name in set(reports[False]) | set(reports[True])
+                       if reports[False].get(name) != reports[True].get(name))
+    for name in differing:
+        print(f"{name} differs\n  two phase: {reports[False].get(name)}\n  stream:    {reports[True].get(name)}")
+    print(f"{len(reports[False])} reports, {len(differing)} differing in stream mode")
+    sys.exit(1 if differing else 0)
@@ -0,0 +1,199 @@
+"""
+Runs preprocessor / feature extractor / matcher mode combinations on a generated synthetic dataset.
+No media files are needed.
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite -pm 2 3 -fm 2 -mo 5 6 7 -e 3 -d 600 -o bench.json
+    python -m benchmarks.suite -pm 2 -fd float32 float16 int8
+
+For every (preprocess, feature) pair: extraction throughput in audio seconds per CPU second and peak RSS.
+For every matcher on top of it: matching throughput in episode seconds (against every song) per CPU second,
+peak RSS, and precision / recall of the matched seconds against the ground truth, per shared feature dtype.
+Every stage runs in a fresh process, so peak RSS is the peak of that stage alone.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from modules.analyze.feature import FeatureManager
+from modules.analyze.matching import MatchingManager
+from modules.analyze.preprocess import PreprocessManager
+from modules.analyze.store import FEATURE_DTYPES, SharedFeatureStore
+
+from .synthetic import generate_dataset
+from .utils import segments_to_seconds
+
+# per mode thresholds on the synthetic data with the SPECTRAL features. MULTV, SUBSQ and NCORR are the best
+# cuts of a sweep over seeds 0-2, none of which separates songs from speech on every seed (precision / recall
+# per seed: MULTV 0.77/0.33, 0/0, 0.27/0.87; SUBSQ 0.70/0.48, 0.85/0.28, 0.72/0.97; NCORR 0.48/0.74,
+# 0.52/0.98, 0.43/0.99). BASIC, MULTI, MULTG and CORRM take minutes per pair and were not swept.
+DEFAULT_THRESHOLDS = {
+    MatchingManager.ModeEnum.BASIC: 20,
+    MatchingManager.ModeEnum.MULTI: 3,
+    MatchingManager.ModeEnum.MULTG: 3,
+    MatchingManager.ModeEnum.CORRM: 20,
+    MatchingManager.ModeEnum.MULTV: 3,
+    MatchingManager.ModeEnum.SUBSQ: 3.5,
+    MatchingManager.ModeEnum.NCORR: 3.5,
+}
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process in bytes.
+    """
+    # VmHWM restarts at exec, while ru_maxrss keeps the peak of the parent at fork time
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def extract_stage(paths, preprocess_mode, feature_mode, sr, feature_folder):
+    """
+    Extracts every file and saves its features to feature_folder/<name>.npy.
+    :return: {'cpu', 'audio_seconds', 'peak_rss', 'hopped_sr'}
+    """
+    st = time.process_time()
+    hopped_sr = None
+    for path in paths:
+        y, _ = PreprocessManager(preprocess_mode, sr=sr).run(path)
+        features, hopped_sr = FeatureManager(feature_mode, sr=sr).run(y)
+        np.save(os.path.join(feature_folder, os.path.basename(path) + '.npy'), features)
+    return {'cpu': time.process_time() - st, 'audio_seconds': sum(sf.info(path).duration for path in paths),
+            'peak_rss': peak_rss(), 'hopped_sr': hopped_sr}
+
+
+def match_stage(episode_paths, song_paths, matcher_mode, th, hopped_sr, feature_folder, feature_dtype='float32'):
+    """
+    Features go through the shared store in feature_dtype, as they do between the runner's processes.
+    :return: {'cpu', 'peak_rss', 'segments': {episode path: [matched segments per song]}}
+    """
+    with SharedFeatureStore(feature_folder, feature_dtype) as store:
+        def load(path):
+            features = np.load(os.path.join(feature_folder, os.path.basename(path) + '.npy'))
+            return SharedFeatureStore.attach(store.publish(path, features, hopped_sr))[0]
+
+        songs = [load(path) for path in song_paths]
+        st = time.process_time()
+        segments = {}
+        for episode_path in episode_paths:
+            matcher = MatchingManager(matcher_mode, sr=hopped_sr, th=th)
+            segments[episode_path] = [matched for _, matched in matcher.run_batch(load(episode_path), songs)]
+        return {'cpu': time.process_time() - st, 'peak_rss': peak_rss(), 'segments': segments}
+
+
+def run_isolated(func, *args):
+    """
+    Runs func in a fresh interpreter and returns its result, or the exception message.
+    """
+    with mp.get_context('spawn').Pool(1) as pool:
+        try:
+            return pool.apply(func, args)
+        except Exception as e:
+            return {'error': f'{type(e).__name__}: {e}'}
+
+
+def precision_recall(segments, episodes, n_songs):
+    """
+    Micro averaged over every (episode, song) pair, on whole seconds.
+    :param segments: {episode path: [matched segments per song]}
+    :param episodes: [(episode path, [Occurrence])]
+    """
+    true_positive = false_positive = false_negative = 0
+    for episode_path, truth in episodes:
+        for song in range(n_songs):
+            expected = set()
+            for occurrence in truth:
+                if occurrence.song == song:
+                    expected.update(range(int(occurrence.start), int(occurrence.end)))
+            predicted = segments_to_seconds(segments[episode_path][song])
+            true_positive += len(predicted & expected)
+            false_positive += len(predicted - expected)
+            false_negative += len(expected - predicted)
+    precision = true_positive / (true_positive + false_positive) if true_positive + false_positive else 0.0
+    recall = true_positive / (true_positive + false_negative) if true_positive + false_negative else 0.0
+    return precision, recall
+
+
+def mb(n_bytes):
+    return n_bytes / 1024 ** 2
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synthetic end to end benchmark')
+    parser.add_argument('-pm', '--preprocessmode', type=int, nargs='+', default=[1, 2, 3],
+                        help='Preprocessor modes. PIPE (4) needs ffmpeg and video files, so it is not generated')
+    parser.add_argument('-fm', '--featuremode', type=int, nargs='+', default=[2])
+    parser.add_argument('-mo', '--matchermode', type=int, nargs='+', default=[4, 5, 6, 7],
+                        help='Matcher modes. 1~3 use fastdtw per window and take minutes per pair')
+    parser.add_argument('-fd', '--featuredtype', nargs='+', default=['float32'], choices=FEATURE_DTYPES,
+                        help='dtypes the features are shared in between extraction and matching')
+    parser.add_argument('-th', '--threshold', type=float, default=None,
+                        help='Threshold of every matcher, defaults to a per mode value')
+    parser.add_argument('-sr', '--samplingrate', type=int, default=2048)
+    parser.add_argument('-e', '--episodes', type=int, default=2)
+    parser.add_argument('-d', '--duration', type=float, default=300, help='Episode duration in seconds')
+    parser.add_argument('-s', '--songs', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None, help='Also write every result to this JSON file')
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix='where-is-the-song-bench-') as folder:
+        song_paths, episodes = generate_dataset(folder, args.episodes, args.duration, args.songs, seed=args.seed)
+        episode_paths = [path for path, _ in episodes]
+        for episode_path, truth in episodes:
+            print(f"{os.path.basename(episode_path)}: "
+                  f"{[(o.song, round(o.start, 1), round(o.end, 1), round(o.tempo, 3)) for o in truth]}")
+
+        for preprocess_mode in args.preprocessmode:
+            for feature_mode in args.featuremode:
+                feature_folder = tempfile.mkdtemp(dir=folder)
+                extraction = run_isolated(extract_stage, episode_paths + song_paths, preprocess_mode, feature_mode,
+                                          args.samplingrate, feature_folder)
+                if 'error' in extraction:
+                    print(f"pm={preprocess_mode} fm={feature_mode}: extraction failed, {extraction['error']}")
+                    rows.append({'preprocess': preprocess_mode, 'feature': feature_mode, **extraction})
+                    continue
+                print(f"pm={preprocess_mode} fm={feature_mode}: extraction "
+                      f"{extraction['audio_seconds'] / max(extraction['cpu'], 1e-9):.1f} audio-s/CPU-s, "
+                      f"peak RSS {mb(extraction['peak_rss']):.0f} MB")
+
+                for matcher_mode, feature_dtype in itertools.product(args.matchermode, args.featuredtype):
+                    th = args.threshold if args.threshold is not None else DEFAULT_THRESHOLDS[matcher_mode]
+                    matching = run_isolated(match_stage, episode_paths, song_paths, matcher_mode, th,
+                                            extraction['hopped_sr'], feature_folder, feature_dtype)
+                    row = {'preprocess': preprocess_mode, 'feature': feature_mode, 'matcher': matcher_mode,
+                           'feature_dtype': feature_dtype, 'threshold': th, 'extraction': extraction}
+                    if 'error' in matching:
+                        print(f"  mo={matcher_mode} fd={feature_dtype}: matching failed, {matching['error']}")
+                        rows.append({**row, **matching})
+                        continue
+                    precision, recall = precision_recall(matching['segments'], episodes, len(song_paths))
+                    episode_seconds = args.episodes * args.duration
+                    print(f"  mo={matcher_mode} fd={feature_dtype} th={th:g}: matching "
+                          f"{episode_seconds / max(matching['cpu'], 1e-9):.1f} episode-s/CPU-s, "
+                          f"peak RSS {mb(matching['peak_rss']):.0f} MB, "
+                          f"precision {precision:.3f}, recall {recall:.3f}")
+                    rows.append({**row, 'matching': {'cpu': matching['cpu'], 'peak_rss': matching['peak_rss']},
+                                 'precision': precision, 'recall': recall})
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': rows}, f, indent=2)
@@ -0,0 +1,107 @@
+"""
+Offline generator of synthetic songs and episodes with known ground truth.
+
+Songs are chord progressions with a melody and percussive clicks at a random tempo. Episodes are
+speech-like noise (filtered noise gated at a syllable rate, with pauses) with excerpts of some songs
+mixed in at known offsets, gains and tempo changes.
+"""
+import os
+from typing import NamedTuple
+
+import librosa
+import numpy as np
+import soundfile as sf
+from scipy.signal import lfilter
+
+
+class Occurrence(NamedTuple):
+    song: int
+    start: float  # seconds into the episode
+    end: float
+    gain: float
+    tempo: float  # playback rate of the excerpt, 1.0 is the original tempo
+
+
+def synthesize_song(seed, duration, sr):
+    rng = np.random.default_rng(seed)
+    beat = 60 / rng.uniform(70, 130)
+    n = int(duration * sr)
+    y = np.zeros(n)
+    roots = rng.integers(45, 60, size=8)
+    t = 0.0
+    while t < duration:
+        root = roots[int(t / (4 * beat)) % 8]
+        for k in range(4):
+            start = int((t + k * beat) * sr)
+            if start >= n:
+                break
+            tt = np.arange(min(int(beat * sr), n - start)) / sr
+            envelope = np.exp(-3 * tt)
+            for interval in (0, 4, 7):
+                f = 440 * 2 ** ((root + interval - 69) / 12)
+                y[start:start + len(tt)] += 0.2 * envelope * np.sin(2 * np.pi * f * tt)
+            f = 440 * 2 ** ((root + 12 + rng.choice([0, 2, 4, 5, 7, 9, 11, 12]) - 69) / 12)
+            y[start:start + len(tt)] += 0.3 * envelope * np.sin(2 * np.pi * f * tt) * (1 + 0.3 * np.sin(4 * np.pi * f * tt))
+            click = rng.normal(0, 1, min(int(0.05 * sr), len(tt)))
+            y[start:start + len(click)] += 0.3 * click * np.exp(-60 * np.arange(len(click)) / sr)
+        t += 4 * beat
+    return y / np.max(np.abs(y))
+
+
+def synthesize_speech(seed, duration, sr):
+    rng = np.random.default_rng(seed)
+    n = int(duration * sr)
+    t = np.arange(n) / sr
+    voice = lfilter([1], [1, -0.95], rng.normal(0, 1, n))
+    syllables = np.sin(2 * np.pi * rng.uniform(3, 5) * t + rng.uniform(0, 6)) > 0
+    pauses = np.sin(2 * np.pi * 0.1 * t + rng.uniform(0, 6)) > -0.3
+    y = voice * syllables * pauses
+    return 0.3 * y / np.max(np.abs(y))
+
+
+def synthesize_episode(seed, duration, songs, sr, occurrences=2, excerpt=(30, 50), gains=(0.4, 0.8),
+                       tempos=(0.94, 1.06)):
+    """
+    :param songs: [song signal] to pick excerpts from
+    :return: episode signal, [Occurrence] sorted by start
+    """
+    rng = np.random.default_rng(seed)
+    y = synthesize_speech(seed, duration, sr)
+    truth = []
+    # one slot per occurrence so excerpts never overlap
+    slot = duration / occurrences
+    for k in range(occurrences):
+        song = int(rng.integers(len(songs)))
+        tempo = float(rng.uniform(*tempos))
+        excerpt_seconds = min(float(rng.uniform(*excerpt)), len(songs[song]) / sr, slot * tempo * 0.9)
+        clip = songs[song][:int(excerpt_seconds * sr)]
+        if abs(tempo - 1) > 1e-3:
+            clip = librosa.effects.time_stretch(clip, rate=tempo)
+        start = k * slot + float(rng.uniform(0, slot - len(clip) / sr))
+        gain = float(rng.uniform(*gains))
+        first = int(start * sr)
+        y[first:first + len(clip)] += gain * clip[:len(y) - first]
+        truth.append(Occurrence(song, start, start + len(clip) / sr, gain, tempo))
+    return y, truth
+
+
+def generate_dataset(folder, episodes=2, episode_duration=300, songs=4, song_duration=60, sr=22050, seed=0):
+    """
+    Writes songs/song_{k}.wav and episodes/episode_{k}.wav under folder.
+    :return: [song path], [(episode path, [Occurrence])]
+    """
+    os.makedirs(os.path.join(folder, 'songs'), exist_ok=True)
+    os.makedirs(os.path.join(folder, 'episodes'), exist_ok=True)
+    signals = [synthesize_song(seed + k, song_duration, sr) for k in range(songs)]
+    song_paths = []
+    for k, y in enumerate(signals):
+        song_paths.append(os.path.join(folder, 'songs', f'song_{k}.wav'))
+        sf.write(song_paths[-1], y, sr)
+
+    episode_list = []
+    for k in range(episodes):
+        y, truth = synthesize_episode(seed + 1000 + k, episode_duration, signals, sr)
+        path = os.path.join(folder, 'episodes', f'episode_{k}.wav')
+        sf.write(path, y / max(np.max(np.abs(y)), 1e-10), sr)
+        episode_list.append((path, truth))
+    return song_paths, episode_list
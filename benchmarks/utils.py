@@ -0,0 +1,28 @@
+def timestamp_to_seconds(timestamp):
+    """
+    Inverse of BaseMatchAlgorithm.index_to_timestamp ("m:s"), to the second.
+    """
+    minutes, seconds = timestamp.split(':')
+    return int(minutes) * 60 + int(seconds)
+
+
+def segments_to_seconds(matched_segments):
+    """
+    :return: set of every whole second covered by the matched segments
+    """
+    covered = set()
+    for start, end in matched_segments:
+        if not end:
+            continue
+        covered.update(range(timestamp_to_seconds(start), timestamp_to_seconds(end)))
+    return covered
+
+
+def agreement(segments_a, segments_b):
+    """
+    Jaccard index of the seconds covered by two lists of matched segments, 1.0 when both are empty.
+    """
+    a, b = segments_to_seconds(segments_a), segments_to_seconds(segments_b)
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
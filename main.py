@@ -1,18 +1,87 @@
 import argparse
-from modules import VideoToAudioRunner, VideoAudioMatchRunner
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Video to audio converter and audio matcher')
     parser.add_argument('-c', '--convert', action='store_true',
-                        help='Convert all .mp4 files in the video folder to .mp3 files in the converted_video folder')
+                        help='Convert all .mp4 files in the video folder to audio files in the converted_video folder, '
+                             'in the format given by -cf (mp3 by default)')
     parser.add_argument('-m', '--match', action='store_true',
                         help='Match the audio files in the audio folder with the '
                              'converted video files in the converted_video folder')
+    parser.add_argument('-rd', '--renderdiagnostics', action='store_true',
+                        help='Plot the window distance curves kept by matcher mode 3, one PNG per episode in '
+                             'results/diagnostics. Runs after -m, or alone on the curves of earlier runs')
+    parser.add_argument('-cf', '--convertformat', help='Converted audio format. mp3, wav (mono 16 bit PCM at -sr) '
+                                                       'or wav32 (mono float32 at -sr)', default='mp3')
+    parser.add_argument('-cw', '--convertworkers', help='Concurrent ffmpeg processes. Defaults to cpu count',
+                        default=None)
+    parser.add_argument('-pp', '--pipe', action='store_true',
+                        help='Pipe the audio of the .mp4 files in the video folder from ffmpeg straight into '
+                             'the matcher, without converted audio files. Skips the conversion of -c')
     parser.add_argument('-th', '--threshold', help='Video Matcher Threshold. Use GraphMatch Option for tuning',
                         default=20)
     parser.add_argument('-sr', '--samplingrate', help='Sampling rate for both videos and songs. Larger makes '
                                                       'significantly slower but little accurate', default=2048)
-    parser.add_argument('-mo', '--matchermode', help='Video Matcher Mode. 1~4', default=2)
+    parser.add_argument('-mo', '--matchermode', help='Video Matcher Mode. 1~7', default=2)
+    parser.add_argument('-pr', '--prune', help='Coarse-to-fine pruning of matcher modes 2, 3, 5. DTW only runs around '
+                                               'windows whose mean features stand out by more than this many '
+                                               'robust standard deviations, e.g. 1. Disabled by default', default=None)
+    parser.add_argument('-pf', '--profile', help='Write per stage timing percentiles and counters of every process '
+                                                 'to report.json / report.csv in this folder', default=None)
+    parser.add_argument('-cp', '--cprofile', help='Comma separated stages to also run under cProfile with --profile, '
+                                                  'e.g. denoise,match', default='')
+    parser.add_argument('-fd', '--featuredtype', help='dtype the features are shared between processes in. float32, '
+                                                      'float16 or int8 (quantized per channel)', default='float32')
+    parser.add_argument('-mf', '--manifest', help='Run manifest (SQLite), e.g. ./run_manifest.sqlite. Only pairs with '
+                                                  'a new or changed file are matched and reports are rebuilt from it '
+                                                  'instead of appended to. Disabled by default', default=None)
+    parser.add_argument('-rm', '--rematch', action='store_true',
+                        help='Match every pair again even if the manifest already has its result')
+    parser.add_argument('-sm', '--startmethod', choices=['fork', 'spawn', 'forkserver'], default=None,
+                        help='Start method of the worker pool. forkserver preloads the analysis modules and warms '
+                             'the librosa caches once for every worker. Defaults to the platform default')
+    parser.add_argument('-rb', '--rambudget', help='RAM budget of the worker pool in MB. Files are extracted longest '
+                                                   'first, as many at once as their estimated peak memory fits in. '
+                                                   'Defaults to 80%% of the available memory', default=None)
+    parser.add_argument('-rt', '--retries', help='Times a task that ran out of memory is retried alone', default=2)
+    parser.add_argument('-co', '--coordinator', action='store_true',
+                        help='With -m, queue the extraction and matching jobs in the work queue (-q) for --worker '
+                             'processes instead of running them in a local pool')
+    parser.add_argument('-wk', '--worker', action='store_true',
+                        help='Run extraction and matching jobs from the work queue (-q) until interrupted')
+    parser.add_argument('-q', '--queue', help='Work queue (SQLite) shared by the coordinator and the workers',
+                        default='./work_queue.sqlite')
+    parser.add_argument('-sf', '--sharedfolder', help='Folder on storage shared with every worker for the extracted '
+                                                      'features. Defaults to the folder of the queue', default=None)
+    parser.add_argument('-wp', '--workerprocesses', help='Worker processes of --worker. Defaults to 80%% of the cores',
+                        default=None)
+    parser.add_argument('-wi', '--workeridle', help='Stop --worker once the queue stayed empty for this many seconds. '
+                                                    'Keeps waiting by default', default=None)
+    parser.add_argument('-sv', '--serve', action='store_true',
+                        help='Keep the features of the audio folder in memory and match clips sent to a local HTTP '
+                             'API (POST /match) until interrupted. Songs added to the folder are picked up live')
+    parser.add_argument('-sp', '--serviceport', help='Port of --serve, on 127.0.0.1', default=8765)
+    parser.add_argument('-ri', '--reloadinterval', help='Seconds between checks of the audio folder for new songs '
+                                                        'in --serve. 0 only reloads on POST /reload', default=5)
+    parser.add_argument('-cd', '--cachefolder', help='Persistent feature cache folder. Pass empty string to disable',
+                        default='./feature_cache')
+    parser.add_argument('-cs', '--cachesize', help='Feature cache size cap in MB. Least recently used entries '
+                                                   'are evicted beyond it', default=2048)
+    parser.add_argument('-st', '--stream', action='store_true',
+                        help='Start matching a pair as soon as both files are extracted, '
+                             'instead of waiting for every extraction to finish')
+    parser.add_argument('-fp', '--fingerprint', help='Query each video against a landmark fingerprint index of '
+                                                     'all songs and only match this many best candidates. '
+                                                     '0 matches every song', default=0)
+    parser.add_argument('-fi', '--fingerprintindex', help='Fingerprint index file, kept between runs',
+                        default='./fingerprint_index.npz')
+    parser.add_argument('-pm', '--preprocessmode', help='Preprocessor Mode. 1: BASIC, 2: SPECTRAL, '
+                                                        '3: SPECTRAL streamed in blocks with bounded memory', default=2)
+    parser.add_argument('-mb', '--memorybudget', help='Peak memory budget of one streamed preprocessing in MB '
+                                                      '(preprocessor mode 3 and --pipe)', default=256)
+    parser.add_argument('-dsr', '--decodesr', help='Resample to this rate right after decoding and run the '
+                                                   'denoising stages on the reduced signal (preprocessor mode 1, 2). '
+                                                   'e.g. the -sr value or 8192', default=None)
 
     args = parser.parse_args()
 
@@ -24,10 +93,51 @@ if __name__ == '__main__':
     threashold = int(args.threshold)
     samplingrate = int(args.samplingrate)
     matchermode = int(args.matchermode)
+    cachesize = int(args.cachesize) * 1024 ** 2
+    preprocessmode = int(args.preprocessmode)
+    if preprocessmode == 3 and args.decodesr:
+        parser.error('-dsr only applies to preprocessor modes 1 and 2, mode 3 streams at the source rate')
+    if preprocessmode == 3:
+        preprocessoptions = {'memory_budget': int(args.memorybudget) * 1024 ** 2}
+    elif args.decodesr:
+        preprocessoptions = {'decode_sr': int(args.decodesr)}
+    else:
+        preprocessoptions = {}
 
-    if args.convert:
-        VideoToAudioRunner(video_folder, converted_folder).run()
+    # runners are imported per role, so --help and -c never load the analysis dependencies
+    if args.convert and not args.pipe:
+        from modules import VideoToAudioRunner
+        VideoToAudioRunner(video_folder, converted_folder, samplingrate, args.convertformat,
+                           int(args.convertworkers) if args.convertworkers else None).run()
 
     if args.match:
-        VideoAudioMatchRunner(converted_folder, audio_folder, results_folder,
-                              samplingrate, threashold, matchermode).run()
+        from modules import VideoAudioMatchRunner
+        pipeoptions = {'memory_budget': int(args.memorybudget) * 1024 ** 2} if args.pipe else None
+        matchoptions = {'prune': float(args.prune)} if args.prune is not None else {}
+        VideoAudioMatchRunner(video_folder if args.pipe else converted_folder, audio_folder, results_folder,
+                              samplingrate, threashold, matchermode,
+                              args.cachefolder or None, cachesize, args.stream,
+                              int(args.fingerprint), args.fingerprintindex,
+                              preprocessmode, preprocessoptions, pipeoptions, matchoptions,
+                              args.profile, [stage for stage in args.cprofile.split(',') if stage],
+                              args.manifest or None, args.rematch,
+                              args.queue if args.coordinator else None, args.sharedfolder,
+                              args.featuredtype, args.startmethod,
+                              int(args.rambudget) * 1024 ** 2 if args.rambudget else None, int(args.retries)).run()
+
+    if args.renderdiagnostics:
+        from modules import DiagnosticsRunner
+        DiagnosticsRunner(results_folder).run()
+
+    if args.worker:
+        from modules import MatchWorkerRunner
+        MatchWorkerRunner(args.queue, int(args.workerprocesses) if args.workerprocesses else None,
+                          args.profile, [stage for stage in args.cprofile.split(',') if stage],
+                          float(args.workeridle) if args.workeridle else None).run()
+
+    if args.serve:
+        from modules import MatchServiceRunner
+        matchoptions = {'prune': float(args.prune)} if args.prune is not None else {}
+        MatchServiceRunner(audio_folder, samplingrate, threashold, matchermode, args.cachefolder or None, cachesize,
+                           int(args.fingerprint), preprocessmode, preprocessoptions, matchoptions,
+                           port=int(args.serviceport), reload_interval=float(args.reloadinterval)).run()
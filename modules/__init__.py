@@ -1,11 +1,32 @@
 from .ffmpeg import video_to_audio
-from .analyze import VideoAudioMatchRunner
+
+
+def __getattr__(name):
+    # the analysis side (numpy, scipy, pywt, librosa) is only imported once a matching runner is asked for,
+    # so conversion alone starts fast
+    if name in ('VideoAudioMatchRunner', 'MatchWorkerRunner', 'MatchServiceRunner'):
+        from . import analyze
+        return getattr(analyze, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class VideoToAudioRunner:
-    def __init__(self, video_folder, converted_folder):
+    def __init__(self, video_folder, converted_folder, sr=None, output_format='mp3', workers=None):
         self.video_folder = video_folder
         self.converted_folder = converted_folder
+        self.sr = sr
+        self.output_format = output_format
+        self.workers = workers
+
+    def run(self):
+        video_to_audio(self.video_folder, self.converted_folder, self.sr, self.output_format, self.workers)
+
+
+class DiagnosticsRunner:
+    def __init__(self, results_folder, processes=None):
+        self.results_folder = results_folder
+        self.processes = processes
 
     def run(self):
-        video_to_audio(self.video_folder, self.converted_folder)
+        from .analyze import render_diagnostics
+        render_diagnostics(self.results_folder, self.processes)
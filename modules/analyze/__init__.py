@@ -1,56 +1,141 @@
 import time
 import fcntl
+import json
+from math import ceil
 import multiprocessing as mp
 import os
 
 from .preprocess import PreprocessManager
 from .feature import FeatureManager
 from .matching import MatchingManager
+from .cache import FeatureCache, content_hash
+from .manifest import RunManifest
+from .diagnostics import render_diagnostics, save_curves
+from .scheduler import AdmissionScheduler, available_memory, probe_frames
+from .store import SharedFeatureStore
+from .workqueue import QueueExecutor, run_worker
+from .profiling import build_report, print_report, profiler
+from .fingerprint import FingerprintIndex, extract_landmarks
+from .fingerprint.landmarks import LANDMARK_VERSION
+from ..ffmpeg import is_partial_file
 
+PREPROCESS_MODE = PreprocessManager.ModeEnum.SPECTRAL
+FEATURE_MODE = FeatureManager.ModeEnum.SPECTRAL
+WARMUP_ENV = 'WHERE_IS_THE_SONG_WARMUP'
+warmup_module = f'{__name__}.warmup'
 
-def process_video_audio_pair(video_path, audio_path,
-                             results, results_folder,
-                             ns, sr, th, mode):
-    # Preprocess & Feature Extraction
-    preprocessor = PreprocessManager(PreprocessManager.ModeEnum.SPECTRAL, sr=sr)
-    feature_extractor = FeatureManager(FeatureManager.ModeEnum.SPECTRAL, sr=sr)
-    # Synchronize video_preprocessed access
-    with ns.video_preprocessed_lock:
-        if video_path not in ns.video_preprocessed:
-            print(f"Preprocessing, Feature Extraction Start for {video_path}")
-            st = time.time()
-            video_processed, video_sr = preprocessor.run(video_path)
-            video_features = feature_extractor.run(video_processed)
-            ns.video_preprocessed[video_path] = video_features
-            print(f"Preprocessing, Feature Extraction for {video_path} done with time: {time.time() - st}s")
-        else:
-            print(f"{video_path} already extracted, skipping...")
-            video_features = ns.video_preprocessed[video_path]
 
-    # Synchronize audio_preprocessed access
-    with ns.audio_preprocessed_lock:
-        if audio_path not in ns.audio_preprocessed:
-            print(f"Preprocessing, Feature Extraction Start for {audio_path}")
-            st = time.time()
-            audio_processed, audio_sr = preprocessor.run(audio_path)
-            audio_features = feature_extractor.run(audio_processed)
-            ns.audio_preprocessed[audio_path] = audio_features
-            print(f"Preprocessing, Feature Extraction for {audio_path} done with time: {time.time() - st}s")
-        else:
-            print(f"{audio_path} already extracted, skipping...")
-            audio_features = ns.audio_preprocessed[audio_path]
+def extract_features(file_path, sr, cache=None, preprocess_mode=PREPROCESS_MODE, preprocess_options=None):
+    """
+    Preprocess & Feature Extraction, served from the persistent feature cache when possible.
+    :param preprocess_options: extra keyword arguments of the preprocessor, e.g. memory_budget
+    :return: (features, hopped_sr)
+    """
+    features, _ = _extract(file_path, sr, cache, False, preprocess_mode, preprocess_options)
+    return features
+
+
+def _extract(file_path, sr, cache=None, fingerprint=False, preprocess_mode=PREPROCESS_MODE, preprocess_options=None):
+    """
+    Runs the preprocessor at most once for both the features and, if asked, the landmark hashes.
+    :return: (features, hopped_sr), (hashes, times) or None
+    """
+    preprocess_options = preprocess_options or {}
+    features = landmarks = None
+    feature_key = landmark_key = None
+    if cache is not None:
+        feature_key, landmark_key = _cache_keys(file_path, sr, cache, fingerprint, preprocess_mode, preprocess_options)
+        features = cache.get(feature_key)
+        if fingerprint:
+            cached = cache.get_arrays(landmark_key)
+            if cached is not None:
+                landmarks = cached['hashes'], cached['times']
+        if features is not None and (landmarks is not None or not fingerprint):
+            print(f"{file_path} found in feature cache, skipping extraction...")
+            return features, landmarks
+
+    preprocessor = PreprocessManager(preprocess_mode, sr=sr, **preprocess_options)
+    feature_extractor = FeatureManager(FEATURE_MODE, sr=sr)
+    print(f"Preprocessing, Feature Extraction Start for {file_path}")
+    st = time.time()
+    processed, processed_sr = preprocessor.run(file_path)
+    if features is None:
+        with profiler.span('feature', file_path):
+            features = feature_extractor.run(processed)
+        if cache is not None:
+            cache.put(feature_key, *features)
+    if fingerprint and landmarks is None:
+        with profiler.span('landmarks', file_path):
+            landmarks = extract_landmarks(processed, processed_sr)
+        if cache is not None:
+            cache.put_arrays(landmark_key, hashes=landmarks[0], times=landmarks[1])
+    print(f"Preprocessing, Feature Extraction for {file_path} done with time: {time.time() - st}s")
+    return features, landmarks
 
-    # Matching
-    print(f"Match process start for {video_path} -- {audio_path}")
+
+def _cache_keys(file_path, sr, cache, fingerprint, preprocess_mode, preprocess_options):
+    """
+    :return: cache keys of the features and of the landmark hashes (None without fingerprint) of one file
+    """
+    preprocess = {'mode': preprocess_mode, **preprocess_options}
+    feature_key = cache.key(file_path, preprocess=preprocess, feature=FEATURE_MODE, sr=sr)
+    landmark_key = cache.key(file_path, preprocess=preprocess, landmarks=LANDMARK_VERSION, sr=sr) \
+        if fingerprint else None
+    return feature_key, landmark_key
+
+
+def extract_file_features(file_path, sr, store, cache=None, fingerprint=False,
+                          preprocess_mode=PREPROCESS_MODE, preprocess_options=None):
+    """
+    Phase one task: extract the features of a single file and publish them to the shared store.
+    :return: (file_path, FeatureHandle or None on failure,
+              (content hash, landmark hashes, landmark times) or None, elapsed seconds)
+    """
     st = time.time()
-    matcher = MatchingManager(mode, sr=video_features[1], th=th)
-    is_matched, matched_segments = matcher.run(video_features[0], audio_features[0], name=audio_path.split()[1])
-    print(f"Match process done for {video_path} -- {audio_path} with time: {time.time() - st}s")
+    handle = landmarks = None
+    try:
+        features, landmarks = _extract(file_path, sr, cache, fingerprint, preprocess_mode, preprocess_options)
+        with profiler.span('publish', file_path):
+            handle = store.publish(file_path, *features)
+        profiler.count('ipc_published_bytes', handle.nbytes)
+        if fingerprint:
+            version = cache.file_version(file_path) if cache is not None else content_hash(file_path)
+            landmarks = (version, *landmarks)
+    except MemoryError:
+        # left to the scheduler, which retries the file with fewer neighbours
+        raise
+    except Exception as e:
+        print(f'[ERROR] Feature extraction of {file_path} failed. Skip. Traceback:')
+        print(e)
+    profiler.flush()
+    return file_path, handle, landmarks, time.time() - st
+
 
-    if is_matched:
-        result = (video_path, audio_path, matched_segments)
-        results.append(result)
-        save_result_to_file(result, results_folder)
+def match_video_audios(video_path, audio_paths, video_handle, audio_handles, th, mode, match_options=None):
+    """
+    Phase two task: match several songs against one video of already extracted features in a single batch,
+    so the per video work of the matcher is shared between them.
+    :param match_options: extra keyword arguments of the matcher, e.g. prune
+    :return: [(video_path, audio_path, is_matched, matched_segments)] per song, elapsed seconds,
+             {audio_path: ratio curve} for diagnostics (MULTG) or None
+    """
+    print(f"Match process start for {video_path} -- {len(audio_paths)} songs")
+    st = time.time()
+    video_features, video_sr = SharedFeatureStore.attach(video_handle)
+    audio_features = [SharedFeatureStore.attach(audio_handle)[0] for audio_handle in audio_handles]
+    profiler.count('ipc_attached_bytes', video_handle.nbytes + sum(handle.nbytes for handle in audio_handles))
+    profiler.count('match_pairs', len(audio_paths))
+    matcher = MatchingManager(mode, sr=video_sr, th=th, **(match_options or {}))
+    with profiler.span('match', video_path):
+        matches = matcher.run_batch(video_features, audio_features,
+                                    names=[os.path.splitext(os.path.basename(audio_path))[0]
+                                           for audio_path in audio_paths])
+    profiler.flush()
+    elapsed = time.time() - st
+    print(f"Match process done for {video_path} -- {len(audio_paths)} songs with time: {elapsed}s")
+    curves = dict(zip(audio_paths, matcher.curves)) if matcher.curves is not None else None
+    return [(video_path, audio_path, is_matched, matched_segments)
+            for audio_path, (is_matched, matched_segments) in zip(audio_paths, matches)], elapsed, curves
 
 
 def save_result_to_file(result, results_folder):
@@ -71,55 +156,456 @@ def save_result_to_file(result, results_folder):
         fcntl.flock(report_file, fcntl.LOCK_UN)
 
 
+def write_report(video_path, matches, results_folder):
+    """
+    Rewrites the whole report of one video, so it never holds the same song twice.
+    Like the appended reports, a video without any match has no report.
+    :param matches: [(audio path, matched segments)]
+    """
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    report_path = f"{results_folder}/{video_name}_report.txt"
+    if not matches:
+        if os.path.exists(report_path):
+            os.remove(report_path)
+        return
+    tmp_path = report_path + '.tmp'
+    with open(tmp_path, "w") as report_file:
+        for audio_path, matched_segments in matches:
+            audio_name = os.path.splitext(os.path.basename(audio_path))[0]
+            report_file.write(f"Audio: {audio_name}\n")
+            report_file.write(f"Matched segments: {matched_segments}\n")
+            report_file.write("\n")
+    os.replace(tmp_path, report_path)
+
+
 class VideoAudioMatchRunner:
     def __init__(self, converted_folder, audio_folder, results_folder, sr=2048, th=20,
-                 mode=MatchingManager.ModeEnum.MULTI):
+                 mode=MatchingManager.ModeEnum.MULTI, cache_folder=None, cache_size=2 * 1024 ** 3,
+                 stream=False, fingerprint_top=0, fingerprint_index='./fingerprint_index.npz',
+                 preprocess_mode=PREPROCESS_MODE, preprocess_options=None, pipe_options=None, match_options=None,
+                 profile_folder=None, cprofile_stages=(), manifest_path=None, rematch=False,
+                 queue_path=None, shared_folder=None, feature_dtype='float32', start_method=None,
+                 ram_budget=None, retries=2):
+        """
+        Features are extracted once per unique file (phase one) and then matched per pair (phase two).
+
+        :param cache_folder: folder of the persistent feature cache. None disables the cache
+        :param cache_size: cache size cap in bytes, least recently used entries are evicted beyond it
+        :param stream: start matching a pair as soon as both of its files are extracted,
+                       instead of waiting for the whole extraction phase
+        :param fingerprint_top: if > 0, query each video against a landmark fingerprint index of all songs
+                                and only match its fingerprint_top best candidates instead of every song
+        :param fingerprint_index: file the fingerprint index is persisted to between runs
+        :param preprocess_mode: PreprocessManager.ModeEnum of the extraction phase
+        :param preprocess_options: extra keyword arguments of the preprocessor, e.g. memory_budget for STREAM
+        :param pipe_options: if given, converted_folder holds the original .mp4 files, whose audio is piped
+                             from ffmpeg into the PIPE preprocessor with these keyword arguments (e.g. memory_budget)
+                             instead of being read from converted audio files
+        :param match_options: extra keyword arguments of the matcher, e.g. prune for the multi window modes
+        :param profile_folder: if given, per stage spans and counters of every process are aggregated into
+                               report.json / report.csv in this folder
+        :param cprofile_stages: stages (decode, denoise, wavelet, emphasis, resample, feature, landmarks,
+                                publish, match) to also run under cProfile, dumped to .prof files in profile_folder
+        :param manifest_path: SQLite run manifest. Pairs already matched with the same configuration and the same
+                              file contents are skipped, and reports are rebuilt from it instead of appended to.
+                              None matches every pair and appends to the reports
+        :param rematch: match every pair again, still recording the results in the manifest
+        :param queue_path: SQLite work queue. If given, this process only coordinates: extraction and matching
+                           jobs are queued for MatchWorkerRunner processes, on this machine or any other that
+                           sees the same files at the same absolute paths, instead of running in a local pool.
+                           The folders and the cache are made absolute for the jobs, so workers may run from any
+                           working folder
+        :param shared_folder: folder on storage shared with every worker for the extracted features
+                              (defaults to the folder of queue_path). Without a queue, /dev/shm is used
+        :param feature_dtype: float32, float16 or int8. dtype the features are shared between processes in
+        :param start_method: start method of the local pool (fork, spawn or forkserver), None for the platform
+                             default. forkserver workers are forked from a server that imported the analysis
+                             package and warmed the librosa caches for this sr once
+        :param ram_budget: bytes the estimated peak memory of the running tasks may add up to. Files are extracted
+                           longest first, as many at once as fit. None for 80% of the memory available at start
+        :param retries: times a task that ran out of memory (MemoryError or a killed worker) is retried alone
+        """
         self.converted_folder = converted_folder
         self.audio_folder = audio_folder
         self.results_folder = results_folder
         self.sr = sr
         self.th = th
         self.mode = mode
+        self.cache_folder = cache_folder
+        self.cache_size = cache_size
+        self.stream = stream
+        self.fingerprint_top = fingerprint_top
+        self.fingerprint_index = fingerprint_index
+        self.preprocess_mode = preprocess_mode
+        self.preprocess_options = preprocess_options or {}
+        self.pipe_options = pipe_options
+        self.match_options = match_options or {}
+        self.profile_folder = profile_folder
+        self.cprofile_stages = cprofile_stages
+        self.manifest_path = manifest_path
+        self.rematch = rematch
+        self.queue_path = queue_path
+        self.shared_folder = shared_folder
+        self.feature_dtype = feature_dtype
+        self.start_method = start_method
+        self.ram_budget = ram_budget
+        self.retries = retries
+        self.pending = None
 
     def run(self):
         if not os.path.exists(self.results_folder):
             os.makedirs(self.results_folder)
 
-        video_files = [os.path.join(self.converted_folder, f) for f in os.listdir(self.converted_folder)]
-        audio_files = [os.path.join(self.audio_folder, f) for f in os.listdir(self.audio_folder)]
+        converted_folder, audio_folder, cache_folder = self.converted_folder, self.audio_folder, self.cache_folder
+        if self.queue_path is not None:
+            # queued jobs name their files, which workers started in any folder (or machine) must resolve the same
+            converted_folder, audio_folder = os.path.abspath(converted_folder), os.path.abspath(audio_folder)
+            cache_folder = cache_folder and os.path.abspath(cache_folder)
+
+        video_files = [os.path.join(converted_folder, f) for f in os.listdir(converted_folder)
+                       if not is_partial_file(f) and (self.pipe_options is None or f.endswith('.mp4'))]
+        audio_files = [os.path.join(audio_folder, f) for f in os.listdir(audio_folder)
+                       if not is_partial_file(f)]
 
-        manager = mp.Manager()
-        results = manager.list()
-        ns = manager.Namespace()
-        ns.video_preprocessed = manager.dict()
-        ns.audio_preprocessed = manager.dict()
-        ns.video_preprocessed_lock = manager.Lock()
-        ns.audio_preprocessed_lock = manager.Lock()
+        cache = FeatureCache(cache_folder, self.cache_size) if cache_folder else None
+
+        all_video_files, all_audio_files = video_files, audio_files
+        manifest = RunManifest(self.manifest_path) if self.manifest_path else None
+        if manifest is not None:
+            video_files, audio_files = self._plan_incremental(manifest, video_files, audio_files, cache)
 
         # Using a process pool for parallel processing
         cores = max(int(mp.cpu_count() * 0.8), 1)
-        print(f'Using {cores} cores')
-        with mp.Pool(processes=cores) as pool:
-            async_results = []  # Store the results of async calls
-            for video_path in video_files:
-                for audio_path in audio_files:
-                    try:
-                        async_result = pool.apply_async(process_video_audio_pair,
-                                                        args=(video_path, audio_path,
-                                                              results, self.results_folder,
-                                                              ns, self.sr, self.th, self.mode))
-                        async_results.append(async_result)
-                    except Exception as e:
-                        print(f'[ERROR] Matching {video_path} & {audio_path} failed. Skip. Traceback:')
-                        print(e)
-
-            # Wait for all async calls to finish
-            for async_result in async_results:
-                async_result.get()
-
-            pool.close()
-            pool.join()
+        print(f'Using {cores} cores' if self.queue_path is None else f'Coordinating workers of {self.queue_path}')
+        # songs of one episode are matched in batches, small enough to still spread over every core
+        pair_count = len(self.pending) if self.pending is not None else len(video_files) * len(audio_files)
+        self.match_batch_size = max(ceil(pair_count / cores), 1)
+
+        results = []
+        timing = {'extraction': 0.0, 'extraction_cpu': 0.0, 'matching': 0.0, 'matching_cpu': 0.0}
+        if self.profile_folder:
+            profiler.configure(self.profile_folder, self.cprofile_stages)
+        with self._store() as store, self._executor(cores) as pool:
+            scheduler = self._scheduler(pool, cores, store)
+            st = time.time()
+            features, candidates, match_keys = self._extract_all(scheduler, video_files, audio_files,
+                                                                 store, cache, timing)
+            timing['extraction'] = time.time() - st
+
+            if not self.stream:
+                timing['matching_start'] = time.time()
+                match_keys = self._submit_matches(scheduler, [(video_path, audio_path) for video_path in video_files
+                                                              for audio_path in self._ready_audios(video_path,
+                                                                                                   audio_files,
+                                                                                                   features,
+                                                                                                   candidates)],
+                                                  features)
+            # in stream mode matching already overlapped extraction, so only the tail is left to wait for
+            self._collect_matches(scheduler, match_keys, features, timing, results, manifest)
+            if match_keys:
+                timing['matching'] = time.time() - timing['matching_start']
+
+            # a task of a dead worker stays pending in the pool forever, which join would wait for
+            if not scheduler.lost:
+                pool.close()
+                pool.join()
+
+        if manifest is not None:
+            if candidates is not None:
+                # pairs left out by the fingerprint pre-selection are settled as not matched for this configuration
+                for video_path, audio_path in self.pending:
+                    if video_path in candidates and audio_path in features and \
+                            audio_path not in candidates[video_path]:
+                        manifest.record(self.config, video_path, audio_path, self.versions, False, [])
+            # reports listing a removed song are rebuilt too, even when none of their pairs changed
+            stale = manifest.videos_matched_outside(self.config, all_audio_files)
+            for video_path in all_video_files:
+                if video_path in video_files or video_path in stale:
+                    write_report(video_path, manifest.matches(self.config, video_path, all_audio_files),
+                                 self.results_folder)
+            manifest.close()
+        timing['total'] = time.time() - st
 
         print("Results:")
         for video_path, audio_path, matched_segments in results:
             print(f"Video: {video_path}, Audio: {audio_path}, Matched segments: {matched_segments}")
+        print("Timing:")
+        print(f"Phase 1 (feature extraction) wall: {timing['extraction']:.2f}s, "
+              f"sum of tasks: {timing['extraction_cpu']:.2f}s")
+        print(f"Phase 2 (matching{', streamed' if self.stream else ''}) wall: {timing['matching']:.2f}s, "
+              f"sum of tasks: {timing['matching_cpu']:.2f}s")
+        print(f"Total wall: {timing['total']:.2f}s")
+        if self.profile_folder:
+            profiler.flush()
+            print_report(build_report(self.profile_folder))
+            print(f"Profile report written to {self.profile_folder}/report.json and report.csv")
+
+    def _store(self):
+        if self.queue_path is None:
+            return SharedFeatureStore(dtype=self.feature_dtype)
+        shared_folder = os.path.abspath(self.shared_folder or os.path.dirname(os.path.abspath(self.queue_path)))
+        os.makedirs(shared_folder, exist_ok=True)
+        return SharedFeatureStore(shared_folder, self.feature_dtype)
+
+    def _executor(self, cores):
+        """
+        :return: a local process pool, or the coordinator side of the work queue.
+                 Both run module level functions through apply_async
+        """
+        if self.queue_path is not None:
+            return QueueExecutor(self.queue_path)
+        context = mp.get_context(self.start_method)
+        if self.start_method == 'forkserver':
+            # read by the warmup module when the server starts, i.e. on the first forkserver pool of the process
+            os.environ[WARMUP_ENV] = json.dumps({'sr': self.sr, 'mode': self.mode})
+            context.set_forkserver_preload([warmup_module])
+        return context.Pool(processes=cores, initializer=_init_worker,
+                            initargs=(self.profile_folder, self.cprofile_stages))
+
+    def _scheduler(self, pool, cores, store):
+        if self.queue_path is not None:
+            # workers of the queue are on other machines, each with its own memory
+            return AdmissionScheduler(pool, poll_seconds=0.5)
+        ram_budget = self.ram_budget or int(available_memory() * 0.8)
+        print(f"RAM budget of the workers: {ram_budget / 1024 ** 2:.0f} MB")
+        return AdmissionScheduler(pool, ram_budget, slots=cores, retries=self.retries,
+                                  marker_folder=os.path.join(store.folder, 'running'))
+
+    def _extraction_memory(self, file_path, videos, cache, fingerprint):
+        """
+        :return: estimated peak memory in bytes of extracting one file, from its headers
+        """
+        preprocess_mode, preprocess_options = self._preprocess_args(file_path, videos)
+        if cache is not None and all(key is None or cache.contains(key) for key in _cache_keys(
+                file_path, self.sr, cache, fingerprint, preprocess_mode, preprocess_options)):
+            return 0
+        try:
+            frames, orig_sr = probe_frames(file_path)
+        except OSError:
+            return 0
+        return PreprocessManager(preprocess_mode, sr=self.sr, **preprocess_options).peak_memory(frames, orig_sr)
+
+    def _extract_all(self, scheduler, video_files, audio_files, store, cache, timing):
+        """
+        Phase one: one extraction task per unique file, spread over the whole pool, longest files first
+        and as many at once as the RAM budget allows.
+        In stream mode, matching tasks are submitted as soon as both sides of a pair are ready.
+        With fingerprinting, songs are extracted and indexed first so that every video can be
+        queried against the whole catalog as soon as it is extracted.
+        :return: {file_path: FeatureHandle}, {video_path: candidate audio paths} or None,
+                 scheduler keys of the streamed matching tasks
+        """
+        videos = set(video_files)
+        fingerprint = self.fingerprint_top > 0
+        index = FingerprintIndex.load(self.fingerprint_index) if fingerprint else None
+        candidates = {} if fingerprint else None
+        features = {}
+        streamed = []
+
+        # songs are short, so extracting them first lets streamed matching start early
+        batches = [audio_files, video_files] if fingerprint else [audio_files + video_files]
+        for batch in batches:
+            keys = []
+            for file_path in dict.fromkeys(batch):
+                keys.append(('extract', file_path))
+                scheduler.submit(keys[-1], extract_file_features,
+                                 (file_path, self.sr, store, cache, fingerprint,
+                                  *self._preprocess_args(file_path, videos)),
+                                 self._extraction_memory(file_path, videos, cache, fingerprint))
+            for (_, file_path), result, error in scheduler.as_completed(keys):
+                if error is not None:
+                    print(f'[ERROR] Feature extraction of {file_path} failed. Skip. Traceback:')
+                    print(error)
+                    continue
+                file_path, handle, landmarks, elapsed = result
+                timing['extraction_cpu'] += elapsed
+                if handle is None:
+                    continue
+                features[file_path] = handle
+
+                if fingerprint and file_path in videos:
+                    candidates[file_path] = self._query_fingerprints(index, file_path, landmarks, features)
+                elif fingerprint and not index.contains(file_path, landmarks[0]):
+                    index.add(file_path, *landmarks)
+
+                if self.stream:
+                    if file_path in videos:
+                        pairs = [(file_path, audio_path)
+                                 for audio_path in self._ready_audios(file_path, audio_files, features, candidates)]
+                    else:
+                        pairs = [(video_path, file_path) for video_path in video_files if video_path in features
+                                 and file_path in self._ready_audios(video_path, audio_files, features, candidates)]
+                    if pairs and 'matching_start' not in timing:
+                        timing['matching_start'] = time.time()
+                    streamed += self._submit_matches(scheduler, pairs, features)
+
+            if fingerprint and batch is audio_files:
+                index.save(self.fingerprint_index)
+        return features, candidates, streamed
+
+    def _preprocess_args(self, file_path, videos):
+        """
+        :return: (preprocess mode, preprocess options) of one file
+        """
+        if self.pipe_options is not None and file_path in videos:
+            return PreprocessManager.ModeEnum.PIPE, self.pipe_options
+        return self.preprocess_mode, self.preprocess_options
+
+    def _plan_incremental(self, manifest, video_files, audio_files, cache):
+        """
+        Keeps only the pairs without an up to date manifest record.
+        :return: videos and audios involved in at least one of those pairs
+        """
+        self.versions = {file_path: cache.file_version(file_path) if cache is not None else content_hash(file_path)
+                         for file_path in video_files + audio_files}
+        self.config = RunManifest.config_key(
+            sr=self.sr, th=self.th, mode=self.mode, feature=FEATURE_MODE,
+            preprocess={'mode': self.preprocess_mode, **self.preprocess_options}, pipe=self.pipe_options,
+            match=self.match_options, fingerprint_top=self.fingerprint_top, feature_dtype=self.feature_dtype)
+        pairs = [(video_path, audio_path) for video_path in video_files for audio_path in audio_files]
+        self.pending = set(pairs if self.rematch else manifest.pending(self.config, pairs, self.versions))
+        print(f"Manifest: {len(self.pending)} of {len(pairs)} pairs are new or changed")
+        return ([video_path for video_path in video_files
+                 if any((video_path, audio_path) in self.pending for audio_path in audio_files)],
+                [audio_path for audio_path in audio_files
+                 if any((video_path, audio_path) in self.pending for video_path in video_files)])
+
+    def _ready_audios(self, video_path, audio_files, features, candidates):
+        if video_path not in features:
+            return []
+        if candidates is not None:
+            ready = candidates.get(video_path, [])
+        else:
+            ready = [audio_path for audio_path in audio_files if audio_path in features]
+        if self.pending is not None:
+            ready = [audio_path for audio_path in ready if (video_path, audio_path) in self.pending]
+        return ready
+
+    def _query_fingerprints(self, index, video_path, landmarks, features):
+        _, hashes, times = landmarks
+        # songs may still be in the index after they were removed from the audio folder
+        ranked = [match for match in index.query(hashes, times, top=len(index.song_paths))
+                  if match[0] in features][:self.fingerprint_top]
+        print(f"Fingerprint candidates for {video_path}: {[(audio_path, votes) for audio_path, votes, _ in ranked]}")
+        return [audio_path for audio_path, _, _ in ranked]
+
+    def _submit_matches(self, scheduler, pairs, features):
+        """
+        Submits one matching task per video and batch of at most match_batch_size of its songs.
+        :return: scheduler keys of the tasks
+        """
+        audios_of = {}
+        for video_path, audio_path in pairs:
+            audios_of.setdefault(video_path, []).append(audio_path)
+        keys = []
+        for video_path, audio_paths in audios_of.items():
+            for first in range(0, len(audio_paths), self.match_batch_size):
+                batch = audio_paths[first:first + self.match_batch_size]
+                audio_handles = [features[audio_path] for audio_path in batch]
+                # every pair is submitted once, so its songs name the task even when stream mode submits
+                # several tasks for one video as its songs finish
+                keys.append(('match', video_path, tuple(batch)))
+                scheduler.submit(keys[-1], match_video_audios,
+                                 (video_path, batch, features[video_path], audio_handles,
+                                  self.th, self.mode, self.match_options),
+                                 _matching_memory(features[video_path], audio_handles))
+        return keys
+
+    def _collect_matches(self, scheduler, keys, features, timing, results, manifest=None):
+        for _, result, error in scheduler.as_completed(keys):
+            if error is not None:
+                print('[ERROR] Matching failed. Skip. Traceback:')
+                print(error)
+                continue
+            matches, elapsed, curves = result
+            timing['matching_cpu'] += elapsed
+            if curves:
+                video_path = matches[0][0]
+                save_curves(self.results_folder, video_path, curves, features[video_path].sr, self.th)
+            for video_path, audio_path, is_matched, matched_segments in matches:
+                if manifest is not None:
+                    manifest.record(self.config, video_path, audio_path, self.versions, is_matched, matched_segments)
+                if is_matched:
+                    result = (video_path, audio_path, matched_segments)
+                    results.append(result)
+                    if manifest is None:
+                        save_result_to_file(result, self.results_folder)
+
+
+class MatchWorkerRunner:
+    def __init__(self, queue_path, processes=None, profile_folder=None, cprofile_stages=(), idle_exit=None):
+        """
+        Worker side of a VideoAudioMatchRunner with a queue_path: runs its extraction and matching jobs.
+        Any number of these may pull from the same queue, on several machines. A job whose worker dies is
+        handed to another one once its lease runs out.
+
+        :param processes: worker processes on this machine, 80% of the cores by default
+        :param profile_folder: as in VideoAudioMatchRunner, should be the folder the coordinator reports from
+        :param idle_exit: exit once the queue stayed empty for this many seconds. None keeps waiting for jobs
+        """
+        self.queue_path = queue_path
+        self.processes = processes
+        self.profile_folder = profile_folder
+        self.cprofile_stages = cprofile_stages
+        self.idle_exit = idle_exit
+
+    def run(self):
+        run_worker(self.queue_path, self.processes, idle_exit=self.idle_exit, initializer=_init_worker,
+                   initargs=(self.profile_folder, self.cprofile_stages))
+
+
+class MatchServiceRunner:
+    def __init__(self, audio_folder, sr=2048, th=20, mode=MatchingManager.ModeEnum.MULTI,
+                 cache_folder=None, cache_size=2 * 1024 ** 3, fingerprint_top=0,
+                 preprocess_mode=PREPROCESS_MODE, preprocess_options=None, match_options=None,
+                 host='127.0.0.1', port=8765, reload_interval=5):
+        """
+        Long running local match service: the features of every song stay in memory between queries,
+        instead of being loaded again by every -m run. See service.MatchRequestHandler for the HTTP API.
+
+        :param fingerprint_top: if > 0, keep a landmark index of the songs in memory too and only match
+                                the fingerprint_top best candidates of each clip
+        :param th, mode: defaults of the queries, each request may override them
+        :param reload_interval: seconds between checks of audio_folder for added, changed or removed songs.
+                                0 only reloads on POST /reload
+        """
+        self.audio_folder = audio_folder
+        self.sr = sr
+        self.th = th
+        self.mode = mode
+        self.cache_folder = cache_folder
+        self.cache_size = cache_size
+        self.fingerprint_top = fingerprint_top
+        self.preprocess_mode = preprocess_mode
+        self.preprocess_options = preprocess_options or {}
+        self.match_options = match_options or {}
+        self.host = host
+        self.port = port
+        self.reload_interval = reload_interval
+
+    def run(self):
+        from .service import MatchService, SongCatalog, serve
+        from .warmup import warm_up
+
+        cache = FeatureCache(self.cache_folder, self.cache_size) if self.cache_folder else None
+        catalog = SongCatalog(self.audio_folder, self.sr, cache, self.fingerprint_top,
+                              self.preprocess_mode, self.preprocess_options)
+        catalog.refresh()
+        if self.reload_interval:
+            catalog.watch(self.reload_interval)
+        # the librosa caches and JIT kernels are filled before listening, not by the first query
+        warm_up(self.sr, self.mode)
+        serve(MatchService(catalog, self.th, self.mode, self.match_options), self.host, self.port)
+
+
+def _matching_memory(video_handle, audio_handles):
+    # float32 copies of every matrix, plus one (song frames, episode frames) float64 cost matrix at a time
+    return 4 * (video_handle.nbytes + sum(handle.nbytes for handle in audio_handles)) + \
+        8 * video_handle.frames * max(handle.frames for handle in audio_handles)
+
+
+def _init_worker(profile_folder, cprofile_stages):
+    if profile_folder:
+        profiler.configure(profile_folder, cprofile_stages, clean=False)
+
+
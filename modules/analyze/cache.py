@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import librosa
+import numpy as np
+import pywt
+
+CACHE_FORMAT_VERSION = 2
+
+
+def content_hash(file_path, chunk_size=1 << 20):
+    """
+    sha256 of the file content, read in chunks so large episodes are never held in memory.
+    """
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FeatureCache:
+    """
+    Persistent on-disk store for extracted features.
+
+    Entries are keyed by the content hash of the source file plus every parameter that
+    changes the result (preprocess/feature mode, sr, library versions), so changing any
+    of them simply misses the old entry. Old entries are evicted in LRU order once the
+    cache grows beyond max_bytes.
+    """
+
+    def __init__(self, cache_folder, max_bytes=2 * 1024 ** 3):
+        self.cache_folder = cache_folder
+        self.hash_folder = os.path.join(cache_folder, 'hashes')
+        self.max_bytes = max_bytes
+        os.makedirs(self.hash_folder, exist_ok=True)
+
+    def _file_hash(self, file_path):
+        # memoized by (path, size, mtime) so unchanged files are hashed only once
+        stat = os.stat(file_path)
+        abs_path = os.path.abspath(file_path)
+        memo_path = os.path.join(self.hash_folder,
+                                 hashlib.sha1(abs_path.encode('utf-8')).hexdigest() + '.json')
+        try:
+            with open(memo_path, 'r') as f:
+                memo = json.load(f)
+            if memo['size'] == stat.st_size and memo['mtime_ns'] == stat.st_mtime_ns:
+                return memo['hash']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        digest = content_hash(file_path)
+        memo = {'path': abs_path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest}
+        self._atomic_write(memo_path, lambda f: f.write(json.dumps(memo).encode('utf-8')))
+        return digest
+
+    def file_version(self, file_path):
+        return self._file_hash(file_path)
+
+    def key(self, file_path, **params):
+        parts = {
+            'file': self._file_hash(file_path),
+            'format': CACHE_FORMAT_VERSION,
+            'librosa': librosa.__version__,
+            'numpy': np.__version__,
+            'pywt': pywt.__version__,
+        }
+        parts.update(params)
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_folder, f'{key}.npz')
+
+    def contains(self, key):
+        return os.path.exists(self._entry_path(key))
+
+    def get(self, key):
+        """
+        :return: (features, hopped_sr) or None on a miss
+        """
+        entry = self.get_arrays(key)
+        if entry is None:
+            return None
+        return entry['features'], float(entry['sr'])
+
+    def put(self, key, features, sr):
+        self.put_arrays(key, features=features, sr=np.float64(sr))
+
+    def get_arrays(self, key):
+        """
+        :return: {name: np.ndarray} or None on a miss
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with np.load(entry_path) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+        except (OSError, ValueError, KeyError):
+            return None
+        # LRU bookkeeping: mtime is the last access time of the entry
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return arrays
+
+    def put_arrays(self, key, **arrays):
+        self._atomic_write(self._entry_path(key), lambda f: np.savez_compressed(f, **arrays))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_folder):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_folder, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_folder, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _atomic_write(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import multiprocessing as mp
+
+import numpy as np
+
+DIAGNOSTICS_FOLDER = 'diagnostics'
+SR_KEY, TH_KEY = '__sr__', '__th__'
+
+
+def diagnostics_folder(results_folder):
+    return os.path.join(results_folder, DIAGNOSTICS_FOLDER)
+
+
+def save_curves(results_folder, video_path, curves, sr, th):
+    """
+    Persists the ratio curves of one episode next to its report, merged with the songs saved by earlier runs.
+    :param curves: {audio path: ratios per video frame}
+    :param sr: frames per second of the curves (hopped sr of the features)
+    """
+    folder = diagnostics_folder(results_folder)
+    os.makedirs(folder, exist_ok=True)
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    path = os.path.join(folder, f'{video_name}.npz')
+    arrays = {}
+    try:
+        with np.load(path) as saved:
+            arrays = {name: saved[name] for name in saved.files}
+    except (OSError, ValueError):
+        pass
+    for audio_path, ratios in curves.items():
+        arrays[os.path.splitext(os.path.basename(audio_path))[0]] = np.asarray(ratios, dtype=np.float32)
+    arrays[SR_KEY], arrays[TH_KEY] = np.float64(sr), np.float64(th)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def render_episode(curves_path):
+    """
+    Draws every song curve of one episode into a single PNG next to curves_path.
+    :return: path of the PNG
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    with np.load(curves_path) as saved:
+        sr, th = float(saved[SR_KEY]), float(saved[TH_KEY])
+        curves = {name: saved[name] for name in sorted(saved.files) if name not in (SR_KEY, TH_KEY)}
+
+    fig, ax = plt.subplots(figsize=(14, 4 + 0.2 * len(curves)))
+    for name, ratios in curves.items():
+        ax.plot(np.arange(len(ratios)) / sr / 60, ratios, linewidth=0.8, label=name)
+    ax.axhline(y=th, color='r', linestyle='--', label='Threshold')
+    ax.set_xlabel('minutes')
+    ax.set_ylabel('mean window distance')
+    ax.set_title(os.path.splitext(os.path.basename(curves_path))[0])
+    ax.legend(fontsize='small', loc='upper right')
+    png_path = os.path.splitext(curves_path)[0] + '.png'
+    fig.savefig(png_path, dpi=150, bbox_inches='tight')
+    plt.close(fig)
+    return png_path
+
+
+def render_diagnostics(results_folder, processes=None):
+    """
+    Renders the episodes whose curves changed since their PNG was drawn, in a process pool of its own.
+    """
+    folder = diagnostics_folder(results_folder)
+    if not os.path.isdir(folder):
+        print(f"No diagnostics in {folder}. Match with -mo 3 first")
+        return
+    stale = []
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith('.npz'):
+            continue
+        curves_path = os.path.join(folder, name)
+        png_path = os.path.splitext(curves_path)[0] + '.png'
+        if not os.path.exists(png_path) or os.path.getmtime(png_path) < os.path.getmtime(curves_path):
+            stale.append(curves_path)
+    processes = min(processes or max(int(mp.cpu_count() * 0.8), 1), max(len(stale), 1))
+    with mp.Pool(processes) as pool:
+        for png_path in pool.imap_unordered(render_episode, stale):
+            print(f"Diagnostics rendered to {png_path}")
@@ -1,8 +1,23 @@
 from abc import *
+from functools import lru_cache
 
 import librosa.feature
 import numpy as np
 
+N_FFT = 2048
+HOP_LENGTH = 512
+
+
+@lru_cache(maxsize=None)
+def mel_filterbank(sr: float, n_fft: int) -> np.ndarray:
+    return librosa.filters.mel(sr=sr, n_fft=n_fft)
+
+
+@lru_cache(maxsize=None)
+def chroma_filterbank(sr: float, n_fft: int, tuning: float) -> np.ndarray:
+    # tuning is estimated with a 0.01 bin resolution, so there are at most a hundred of these per (sr, n_fft)
+    return librosa.filters.chroma(sr=sr, n_fft=n_fft, tuning=tuning)
+
 
 class FeatureManager:
     class ModeEnum:
@@ -41,19 +56,26 @@ class BasicFeatureExtractor(BaseFeatureExtractor):
 class SpectralFeatureExtractor(BaseFeatureExtractor):
     def run(self, y: np.ndarray) -> tuple[np.ndarray, float]:
         """
+        All features are derived from one shared STFT through cached filterbanks, with the same
+        parameters librosa.feature.mfcc / chroma_stft / spectral_contrast would use on y.
         :param y: resampled data shape with (frames,)
-        :return: feature extracted data (features, frames), hopped_sr (sr / 512)
+        :return: feature extracted data (features, frames) as float32, hopped_sr (sr / 512)
         """
+        magnitude = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+        power = magnitude ** 2
+
         # MFCC
-        mfcc = librosa.feature.mfcc(y=y, sr=self.sr, n_mfcc=13)
+        mel = mel_filterbank(self.sr, N_FFT) @ power
+        mfcc = librosa.feature.mfcc(S=librosa.power_to_db(mel), n_mfcc=13)
 
         # 크로마 그램
-        chromagram = librosa.feature.chroma_stft(y=y, sr=self.sr)
+        tuning = round(float(librosa.estimate_tuning(S=power, sr=self.sr, bins_per_octave=12)), 2)
+        chromagram = librosa.util.normalize(chroma_filterbank(self.sr, N_FFT, tuning) @ power, norm=np.inf, axis=0)
 
         # 스펙트럼 대비
-        spectral_contrast = librosa.feature.spectral_contrast(y=y, sr=self.sr, fmin=self.sr / 128)
+        spectral_contrast = librosa.feature.spectral_contrast(S=magnitude, sr=self.sr, n_fft=N_FFT, fmin=self.sr / 128)
 
         # 특징 벡터 결합
-        features = np.concatenate((mfcc, chromagram, spectral_contrast), axis=0)
+        features = np.concatenate((mfcc, chromagram, spectral_contrast), axis=0).astype(np.float32)
 
-        return features, self.sr / 512
+        return features, self.sr / HOP_LENGTH
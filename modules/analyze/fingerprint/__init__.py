@@ -0,0 +1,2 @@
+from .index import FingerprintIndex
+from .landmarks import extract_landmarks
@@ -0,0 +1,99 @@
+import os
+import tempfile
+
+import numpy as np
+
+from .landmarks import LANDMARK_VERSION
+
+
+class FingerprintIndex:
+    """
+    Inverted index of landmark hashes: hash -> (song id, time offset).
+
+    Postings are kept as flat arrays sorted by hash, so a query is a vectorized searchsorted
+    followed by offset histogram voting. Each song is stored with a version string (its content
+    hash), and re-adding a changed song replaces its old postings.
+    """
+
+    def __init__(self):
+        self.song_paths = []
+        self.song_versions = []
+        self.hashes = np.empty(0, dtype=np.uint32)
+        self.song_ids = np.empty(0, dtype=np.int32)
+        self.offsets = np.empty(0, dtype=np.int32)
+
+    @classmethod
+    def load(cls, index_path):
+        index = cls()
+        if not os.path.exists(index_path):
+            return index
+        with np.load(index_path) as data:
+            if int(data['version']) != LANDMARK_VERSION:
+                print(f"{index_path} was built with another landmark version, rebuilding...")
+                return index
+            index.song_paths = data['song_paths'].tolist()
+            index.song_versions = data['song_versions'].tolist()
+            index.hashes = data['hashes']
+            index.song_ids = data['song_ids']
+            index.offsets = data['offsets']
+        return index
+
+    def save(self, index_path):
+        folder = os.path.dirname(os.path.abspath(index_path))
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, version=LANDMARK_VERSION,
+                     song_paths=np.array(self.song_paths, dtype=str),
+                     song_versions=np.array(self.song_versions, dtype=str),
+                     hashes=self.hashes, song_ids=self.song_ids, offsets=self.offsets)
+        os.replace(tmp_path, index_path)
+
+    def contains(self, song_path, version):
+        return song_path in self.song_paths and self.song_versions[self.song_paths.index(song_path)] == version
+
+    def add(self, song_path, version, hashes, times):
+        if song_path in self.song_paths:
+            song_id = self.song_paths.index(song_path)
+            self.song_versions[song_id] = version
+            keep = self.song_ids != song_id
+            self.hashes, self.song_ids, self.offsets = self.hashes[keep], self.song_ids[keep], self.offsets[keep]
+        else:
+            song_id = len(self.song_paths)
+            self.song_paths.append(song_path)
+            self.song_versions.append(version)
+
+        hashes = np.concatenate((self.hashes, np.asarray(hashes, dtype=np.uint32)))
+        song_ids = np.concatenate((self.song_ids, np.full(len(hashes) - len(self.hashes), song_id, dtype=np.int32)))
+        offsets = np.concatenate((self.offsets, np.asarray(times, dtype=np.int32)))
+        order = np.argsort(hashes, kind='stable')
+        self.hashes, self.song_ids, self.offsets = hashes[order], song_ids[order], offsets[order]
+
+    def query(self, hashes, times, top=5, min_votes=5) -> list[tuple[str, int, int]]:
+        """
+        Votes every (song, episode time - song time) pair of matching hashes.
+        A song playing in the episode piles its votes up in one offset bin.
+        :return: [(song path, votes of the best offset, best offset in landmark frames)], best first
+        """
+        hashes = np.asarray(hashes, dtype=np.uint32)
+        times = np.asarray(times, dtype=np.int64)
+        lo = np.searchsorted(self.hashes, hashes, side='left')
+        hi = np.searchsorted(self.hashes, hashes, side='right')
+        counts = hi - lo
+        total = int(counts.sum())
+        if total == 0:
+            return []
+
+        # expand every query hash into all of its postings
+        postings = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+        song_ids = self.song_ids[postings].astype(np.int64)
+        deltas = np.repeat(times, counts) - self.offsets[postings]
+
+        pairs, votes = np.unique(np.stack((song_ids, deltas)), axis=1, return_counts=True)
+        best = {}
+        for (song_id, delta), vote in zip(pairs.T, votes):
+            if vote >= min_votes and vote > best.get(song_id, (0, 0))[0]:
+                best[song_id] = (int(vote), int(delta))
+
+        ranked = sorted(best.items(), key=lambda item: -item[1][0])[:top]
+        return [(self.song_paths[song_id], vote, delta) for song_id, (vote, delta) in ranked]
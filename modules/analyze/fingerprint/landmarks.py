@@ -0,0 +1,56 @@
+import librosa
+import numpy as np
+from scipy.ndimage import maximum_filter
+
+N_FFT = 256
+HOP_LENGTH = 64
+PEAK_NEIGHBORHOOD = (15, 9)  # (frequency bins, frames)
+PEAKS_PER_SECOND = 30
+FAN_OUT = 5
+MAX_DT = 63  # frames, fits in 6 bits
+MAX_DF = 31  # bins
+
+LANDMARK_VERSION = 1
+
+
+def find_peaks(y: np.ndarray, sr: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Spectral peaks (constellation) of a preprocessed signal.
+    :return: peak frames, peak frequency bins, sorted by frame
+    """
+    S = np.abs(librosa.stft(y.astype(np.float32), n_fft=N_FFT, hop_length=HOP_LENGTH))
+    S = librosa.amplitude_to_db(S, ref=np.max)
+
+    is_peak = (S == maximum_filter(S, size=PEAK_NEIGHBORHOOD)) & (S > np.mean(S))
+    bins, frames = np.nonzero(is_peak)
+    if len(frames) == 0:
+        return frames, bins
+
+    # keep only the strongest peaks so density does not depend on loudness
+    n_keep = int(PEAKS_PER_SECOND * S.shape[1] * HOP_LENGTH / sr) + 1
+    if len(frames) > n_keep:
+        strongest = np.argpartition(-S[bins, frames], n_keep)[:n_keep]
+        frames, bins = frames[strongest], bins[strongest]
+
+    order = np.lexsort((bins, frames))
+    return frames[order], bins[order]
+
+
+def extract_landmarks(y: np.ndarray, sr: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Pairs every peak with the next FAN_OUT peaks in its target zone and hashes each pair
+    as (anchor bin, target bin, time delta).
+    :return: hashes (uint32), anchor frames (int32) in HOP_LENGTH / sr units
+    """
+    frames, bins = find_peaks(y, sr)
+    hashes, times = [], []
+    for k in range(1, FAN_OUT + 1):
+        anchor_frames, anchor_bins = frames[:-k], bins[:-k]
+        dt = frames[k:] - anchor_frames
+        df = bins[k:].astype(np.int64) - anchor_bins
+        valid = (dt > 0) & (dt <= MAX_DT) & (np.abs(df) <= MAX_DF)
+        hashes.append((anchor_bins[valid].astype(np.uint32) << 14)
+                      | (bins[k:][valid].astype(np.uint32) << 6)
+                      | dt[valid].astype(np.uint32))
+        times.append(anchor_frames[valid].astype(np.int32))
+    return np.concatenate(hashes), np.concatenate(times)
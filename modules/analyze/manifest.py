@@ -0,0 +1,71 @@
+import json
+import sqlite3
+import time
+
+
+class RunManifest:
+    """
+    SQLite record of every (video, audio) pair matched under a given configuration, with the content
+    versions of both files and the result. A later run only has to match the pairs whose record is
+    missing or was made with another version of either file, and reports can be rebuilt from it.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS pairs (
+                config TEXT NOT NULL,
+                video TEXT NOT NULL,
+                audio TEXT NOT NULL,
+                video_version TEXT NOT NULL,
+                audio_version TEXT NOT NULL,
+                matched INTEGER NOT NULL,
+                segments TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (config, video, audio)
+            )''')
+        self.connection.commit()
+
+    @staticmethod
+    def config_key(**config):
+        return json.dumps(config, sort_keys=True)
+
+    def pending(self, config, pairs, versions):
+        """
+        :param pairs: [(video path, audio path)]
+        :param versions: {file path: content version}
+        :return: the pairs without an up to date record
+        """
+        recorded = {(video, audio): (video_version, audio_version) for video, audio, video_version, audio_version in
+                    self.connection.execute('SELECT video, audio, video_version, audio_version FROM pairs '
+                                            'WHERE config = ?', (config,))}
+        return [(video, audio) for video, audio in pairs
+                if recorded.get((video, audio)) != (versions[video], versions[audio])]
+
+    def record(self, config, video, audio, versions, matched, segments):
+        self.connection.execute('INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                (config, video, audio, versions[video], versions[audio], int(matched),
+                                 json.dumps(segments), time.time()))
+        self.connection.commit()
+
+    def matches(self, config, video, audio_files):
+        """
+        :return: [(audio path, matched segments)] recorded for video among audio_files, matched ones only
+        """
+        audio_files = set(audio_files)
+        return [(audio, [tuple(segment) for segment in json.loads(segments)]) for audio, segments in
+                self.connection.execute('SELECT audio, segments FROM pairs WHERE config = ? AND video = ? '
+                                        'AND matched = 1 ORDER BY audio', (config, video))
+                if audio in audio_files]
+
+    def videos_matched_outside(self, config, audio_files):
+        """
+        :return: videos with a recorded match against a song not among audio_files, e.g. removed since
+        """
+        audio_files = set(audio_files)
+        return {video for video, audio in
+                self.connection.execute('SELECT video, audio FROM pairs WHERE config = ? AND matched = 1', (config,))
+                if audio not in audio_files}
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,68 @@
+import numpy as np
+from scipy.fft import irfft, next_fast_len, rfft
+
+
+class CorrelationEngine:
+    """
+    Normalized cross-correlation (NCC) of many songs against one episode.
+
+    The episode spectrum is computed once, over all feature channels in a single real FFT padded to
+    an FFT-friendly length, and reused for every song. A stack of songs is correlated in one batched
+    call: channels are summed in the frequency domain, so only one inverse FFT runs per song.
+    Every channel is centered over the compared window, and the result is normalized by the
+    episode window energy (from cumulative sums) and the song energy. Values are in [-1, 1].
+    """
+
+    def __init__(self, video_features_T: np.ndarray, max_song_frames: int):
+        """
+        :param video_features_T: (frames, features)
+        :param max_song_frames: length of the longest song that will be correlated
+        """
+        self.video = np.asarray(video_features_T, dtype=np.float64)
+        self.n_frames = self.video.shape[0]
+        self.fft_size = next_fast_len(self.n_frames + max_song_frames - 1, real=True)
+        self.video_spectrum = rfft(self.video, n=self.fft_size, axis=0)  # (bins, features)
+
+        zero = np.zeros((1, self.video.shape[1]))
+        self.cumsum = np.concatenate((zero, np.cumsum(self.video, axis=0)))
+        self.cumsum_sq = np.concatenate((zero, np.cumsum(self.video ** 2, axis=0)))
+
+    def correlate(self, songs_T: list[np.ndarray]) -> list[np.ndarray]:
+        """
+        :param songs_T: [(song frames, features)], each at most max_song_frames long
+        :return: [(episode frames - song frames + 1,) NCC for every lag of the song], one per song
+        """
+        lengths = [song.shape[0] for song in songs_T]
+        stacked = np.zeros((len(songs_T), max(lengths), self.video.shape[1]))
+        for k, song in enumerate(songs_T):
+            stacked[k, :lengths[k]] = song - np.mean(song, axis=0)
+
+        # correlation = convolution with the time reversed song, summed over channels
+        song_spectrum = rfft(stacked[:, ::-1], n=self.fft_size, axis=1)
+        correlation = irfft(np.sum(self.video_spectrum[np.newaxis] * song_spectrum, axis=2), n=self.fft_size, axis=1)
+
+        results = []
+        for k, m in enumerate(lengths):
+            lags = self.n_frames - m + 1
+            if lags <= 0:
+                results.append(np.empty(0))
+                continue
+            # correlation of lag l ends at index l + max_len - 1 of the full convolution
+            numerator = correlation[k, max(lengths) - 1:max(lengths) - 1 + lags]
+            window_sum = self.cumsum[m:m + lags] - self.cumsum[:lags]
+            window_sq = self.cumsum_sq[m:m + lags] - self.cumsum_sq[:lags]
+            video_energy = np.sum(np.maximum(window_sq - window_sum ** 2 / m, 0.0), axis=1)
+            song_energy = np.sum(stacked[k] ** 2)
+            results.append(numerator / np.maximum(np.sqrt(video_energy * song_energy), 1e-10))
+        return results
+
+
+def robust_zscore(values: np.ndarray) -> np.ndarray:
+    """
+    (values - median) / (1.4826 * MAD), i.e. standard deviations of the bulk of values, ignoring outliers.
+    """
+    if len(values) == 0:
+        return values
+    median = np.median(values)
+    mad = 1.4826 * np.median(np.abs(values - median))
+    return (values - median) / max(mad, 1e-10)
@@ -0,0 +1,105 @@
+import numpy as np
+
+
+def normalize_rows(x: np.ndarray, eps: float = 1e-10) -> np.ndarray:
+    """
+    :param x: (n, features)
+    :return: (n, features) float64 frames scaled to unit norm
+    """
+    x = np.asarray(x, dtype=np.float64)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), eps)
+
+
+def cosine_distance_matrix(x: np.ndarray, y: np.ndarray, eps: float = 1e-10) -> np.ndarray:
+    """
+    Same measure as scipy.spatial.distance.cosine, for every pair of frames at once.
+    :param x: (n, features)
+    :param y: (m, features)
+    :return: (n, m) cosine distances
+    """
+    return 1.0 - normalize_rows(x, eps) @ normalize_rows(y, eps).T
+
+
+def batched_band_dtw(cost: np.ndarray, starts: np.ndarray, window: int, radius: int) -> np.ndarray:
+    """
+    Sakoe-Chiba band constrained DTW of many equally sized windows at once.
+
+    Window b aligns cost[starts[b]:starts[b] + window, :window] from (0, 0) to
+    (window - 1, window - 1) with the usual (1, 0), (0, 1), (1, 1) steps, and |i - j| <= radius.
+    Python only loops over the cells of one band, every step is vectorized over the windows.
+
+    :param cost: (video frames, window) local distances between every video frame and every slice frame
+    :param starts: (windows,) first video frame of each window
+    :return: (windows,) accumulated distances along the optimal path
+    """
+    starts = np.asarray(starts)
+    n_windows = len(starts)
+    prev = np.full((n_windows, window), np.inf)
+    cur = np.full((n_windows, window), np.inf)
+
+    for i in range(window):
+        row = cost[starts + i]  # (windows, window)
+        lo, hi = max(0, i - radius), min(window - 1, i + radius)
+        cur.fill(np.inf)
+        if i == 0:
+            cur[:, 0] = row[:, 0]
+        else:
+            # vertical and diagonal predecessors come from the previous row, vectorized over j
+            best = prev[:, lo:hi + 1].copy()
+            if lo > 0:
+                np.minimum(best, prev[:, lo - 1:hi], out=best)
+            else:
+                np.minimum(best[:, 1:], prev[:, lo:hi], out=best[:, 1:])
+            cur[:, lo:hi + 1] = row[:, lo:hi + 1] + best
+        # horizontal predecessors run along the row
+        for j in range(max(lo, 1), hi + 1):
+            np.minimum(cur[:, j], row[:, j] + cur[:, j - 1], out=cur[:, j])
+        prev, cur = cur, prev
+
+    return prev[:, window - 1]
+
+
+def subsequence_dtw(query: np.ndarray, target: np.ndarray,
+                    target_normalized: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Open-begin / open-end subsequence DTW of the whole query against the whole target.
+
+    Uses the step sizes (1, 1), (2, 1), (1, 2) so every row only depends on the two previous rows.
+    The two skip steps add their local cost twice, standing in for the frame they skip, so a path never
+    gets cheaper by skipping frames and its cost is at least len(query) local distances.
+    The accumulated cost is then computed row by row over the query, vectorized over the target,
+    in O(len(query) * len(target)) time and O(len(target)) memory. The start of the best path
+    ending at each target frame is propagated along the rows, so no backtracking is needed.
+
+    :param query: (m, features), e.g. a song
+    :param target: (n, features), e.g. a whole episode
+    :param target_normalized: normalize_rows(target), to share it between the queries of one target
+    :return: (n,) accumulated cost of the best path ending at each target frame,
+             (n,) target frame where that path starts
+    """
+    n = target.shape[0]
+    target_norm = normalize_rows(target) if target_normalized is None else target_normalized
+    query_norm = normalize_rows(query)
+
+    # open begin: a path may start at any target frame
+    prev1 = 1.0 - target_norm @ query_norm[0]
+    start1 = np.arange(n)
+    prev2 = np.full(n, np.inf)
+    start2 = np.zeros(n, dtype=np.int64)
+
+    for m in range(1, query_norm.shape[0]):
+        local = 1.0 - target_norm @ query_norm[m]
+        candidates = np.full((3, n), np.inf)
+        candidates[0, 1:] = prev1[:-1] + local[1:]  # (1, 1)
+        candidates[1, 1:] = prev2[:-1] + 2 * local[1:]  # (2, 1)
+        candidates[2, 2:] = prev1[:-2] + 2 * local[2:]  # (1, 2)
+        step = np.argmin(candidates, axis=0)
+        cur = candidates[step, np.arange(n)]
+
+        starts = np.stack((np.roll(start1, 1), np.roll(start2, 1), np.roll(start1, 2)))
+        cur_start = starts[step, np.arange(n)]
+
+        prev2, start2 = prev1, start1
+        prev1, start1 = cur, cur_start
+
+    return prev1, start1
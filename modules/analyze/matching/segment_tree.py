@@ -1,27 +1,28 @@
-class RangeUpdatePointQuery:
+import numpy as np
+
+
+class RangeAccumulator:
     """
-    Here, idx will be 0 ~ n - 1. so need modif in this class.
+    Range add, point query over n indices for the case where every update happens before the first query.
+    Ranges are inclusive [i, j] (j may be n). Updates are buffered in a difference array and all point
+    values come from one np.cumsum.
     """
 
     def __init__(self, n):
-        self.nodes = n + 1
-        self.tree = [0] * (n + 1)
-
-    def _update(self, i, v):
-        while i < self.nodes:
-            self.tree[i] += v
-            i += i & -i
-
-    def _get(self, i):
-        res = 0
-        while i:
-            res += self.tree[i]
-            i -= i & -i
-        return res
+        self.n = n
+        self.diff = np.zeros(n + 2)
 
-    def update(self, i, j, v):
-        self._update(i + 1, v)
-        self._update(j + 2, -v)
+    def update_many(self, starts, ends, values):
+        """
+        Adds values[k] to every index in [starts[k], ends[k]], for all k at once.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        values = np.broadcast_to(np.asarray(values, dtype=np.float64), starts.shape)
+        np.add.at(self.diff, starts, values)
+        np.add.at(self.diff, np.asarray(ends, dtype=np.int64) + 1, -values)
 
-    def get(self, i):
-        return self._get(i + 1)
+    def values(self) -> np.ndarray:
+        """
+        :return: (n,) value of every index
+        """
+        return np.cumsum(self.diff[:self.n])
@@ -11,11 +11,9 @@ def remove_noise(audio):
 # 스펙트럼 서브트랙션을 사용한 노이즈 제거 함수
 def spectral_subtraction(audio, sr):
     noise_est = np.mean(audio)
-    _, spectral_noise = librosa.magphase(librosa.stft(audio))
-    spectral_noise = np.abs(np.mean(spectral_noise, axis=1))
-
     S = librosa.stft(audio)
     magnitude, phase = librosa.magphase(S)
+    spectral_noise = np.abs(np.mean(phase, axis=1))
 
     magnitude -= noise_est * spectral_noise[:, np.newaxis]
     magnitude = np.maximum(magnitude, 0.0)
@@ -24,6 +22,15 @@ def spectral_subtraction(audio, sr):
     return noise_reduced_audio
 
 
+# 주어진 노이즈 추정치로 스펙트럼 서브트랙션 (스트리밍용, S = librosa.stft(audio))
+def subtract_noise_spectrum(S, noise_est, spectral_noise, length):
+    magnitude, phase = librosa.magphase(S)
+
+    magnitude -= noise_est * spectral_noise[:, np.newaxis]
+    magnitude = np.maximum(magnitude, 0.0)
+
+    return librosa.istft(magnitude * phase, length=length)
+
 
 # 음성 강조 함수
 def emphasize_audio(audio, alpha=0.97):
@@ -1,30 +1,91 @@
 from abc import *
+from math import ceil, gcd
 
 import pywt
+import soundfile as sf
 
 from .functions import *
+from ..profiling import profiler
+from ...ffmpeg import decode_blocks, probe_sample_rate
 
 
 class PreprocessManager:
     class ModeEnum:
         BASIC = 1
         SPECTRAL = 2
+        STREAM = 3
+        PIPE = 4
 
-    def __init__(self, mode: int, sr: float = 8000):
+    def __init__(self, mode: int, sr: float = 8000, **kwargs):
         if mode == self.ModeEnum.BASIC:
-            self.preprocessor = BasicPreprocessor(sr)
+            self.preprocessor = BasicPreprocessor(sr, **kwargs)
         elif mode == self.ModeEnum.SPECTRAL:
-            self.preprocessor = SpectralPreprocessor(sr)
+            self.preprocessor = SpectralPreprocessor(sr, **kwargs)
+        elif mode == self.ModeEnum.STREAM:
+            self.preprocessor = StreamingSpectralPreprocessor(sr, **kwargs)
+        elif mode == self.ModeEnum.PIPE:
+            self.preprocessor = PipedSpectralPreprocessor(sr, **kwargs)
         else:
             raise ValueError(f"Invalid Preprocessor Type : {mode}")
 
     def run(self, audio_path: str) -> tuple[np.ndarray, float]:
         return self.preprocessor.run(audio_path)
 
+    def peak_memory(self, frames: int, orig_sr: float) -> int:
+        return self.preprocessor.peak_memory(frames, orig_sr)
+
 
 class BasePreprocessor(ABC):
-    def __init__(self, sr: float = 8000):
+    BYTES_PER_SAMPLE = 96  # peak bytes per input sample of the whole file stages
+    DECODE_BYTES_PER_SAMPLE = 12  # decoded float32 signal and its emphasized copy, before decode_sr resampling
+
+    def __init__(self, sr: float = 8000, decode_sr: float = None):
+        """
+        :param decode_sr: decode (resampling while loading) at this rate and run every stage on the reduced signal,
+                          instead of running them at the native rate and resampling to sr as the last step
+        """
         self.sr = sr
+        self.decode_sr = decode_sr
+
+    def load(self, audio_path: str) -> tuple[np.ndarray, float]:
+        with profiler.span('decode', audio_path):
+            return self._load(audio_path)
+
+    def _load(self, audio_path: str) -> tuple[np.ndarray, float]:
+        y, sr = librosa.load(audio_path, sr=None)
+        self.emphasis_alpha, self.emphasis_gain, self.reference_peak = 0.97, 1.0, None
+        if self.decode_sr is None or sr == self.decode_sr:
+            return y, sr
+
+        # Resample first, but keep the result comparable with the native order: the pre-emphasis zero stays
+        # at the same frequency (alpha ** (native / decode)) with the same gain in the remaining band, and the
+        # signal is normalized by the peak of the full band emphasized signal, as the native order does.
+        self.emphasis_alpha = 0.97 ** (sr / self.decode_sr)
+        self.emphasis_gain = 0.97 * self.decode_sr / (self.emphasis_alpha * sr)
+        self.reference_peak = np.max(np.abs(emphasize_audio(y)))
+        return librosa.resample(y, orig_sr=sr, target_sr=self.decode_sr), self.decode_sr
+
+    def emphasize_and_normalize(self, y: np.ndarray) -> np.ndarray:
+        y = emphasize_audio(y, self.emphasis_alpha)
+        if self.reference_peak is None:
+            return normalize_audio(y)
+        return y * self.emphasis_gain / self.reference_peak
+
+    def resample(self, y: np.ndarray, sr: float) -> np.ndarray:
+        if sr == self.sr:
+            return y
+        return librosa.resample(y, orig_sr=sr, target_sr=self.sr)
+
+    def peak_memory(self, frames: int, orig_sr: float) -> int:
+        """
+        Rough peak memory of preprocessing a file, for scheduling.
+        :param frames: samples per channel of the file
+        :param orig_sr: sample rate of the file
+        :return: bytes
+        """
+        if self.decode_sr is None or orig_sr == self.decode_sr:
+            return int(frames * self.BYTES_PER_SAMPLE)
+        return int(frames * (self.DECODE_BYTES_PER_SAMPLE + self.BYTES_PER_SAMPLE * self.decode_sr / orig_sr))
 
     @abstractmethod
     def run(self, audio_path: str) -> tuple[np.ndarray, float]:
@@ -32,34 +93,167 @@ class BasePreprocessor(ABC):
 
 
 class BasicPreprocessor(BasePreprocessor):
+    BYTES_PER_SAMPLE = 32
+
     def run(self, audio_path: str) -> tuple[np.ndarray, float]:
-        y, sr = librosa.load(audio_path, sr=None)
-        y = remove_noise(y)
-        y = emphasize_audio(y)
-        y = normalize_audio(y)
-        y = librosa.resample(y, orig_sr=sr, target_sr=self.sr)
+        y, sr = self.load(audio_path)
+        with profiler.span('denoise', audio_path):
+            y = remove_noise(y)
+        with profiler.span('emphasis', audio_path):
+            y = self.emphasize_and_normalize(y)
+        with profiler.span('resample', audio_path):
+            y = self.resample(y, sr)
 
         return y, self.sr
 
 
 class SpectralPreprocessor(BasePreprocessor):
     def run(self, audio_path: str) -> tuple[np.ndarray, float]:
-        y, sr = librosa.load(audio_path, sr=None)
+        y, sr = self.load(audio_path)
         print(f"{audio_path} - shape: {y.shape}, sr: {sr}")
         # 노이즈 제거
-        y = spectral_subtraction(y, sr)
+        with profiler.span('denoise', audio_path):
+            y = spectral_subtraction(y, sr)
 
         # 이산 웨이블릿 변환
-        coeffs = pywt.wavedec(y, wavelet='db4', mode='per')
-        y = pywt.waverec(coeffs, wavelet='db4', mode='per')
+        with profiler.span('wavelet', audio_path):
+            coeffs = pywt.wavedec(y, wavelet='db4', mode='per')
+            y = pywt.waverec(coeffs, wavelet='db4', mode='per')
 
-        # 음성 강조
-        y = emphasize_audio(y)
-
-        # 정규화
-        y = normalize_audio(y)
+        # 음성 강조, 정규화
+        with profiler.span('emphasis', audio_path):
+            y = self.emphasize_and_normalize(y)
 
         # 리샘플링 (선택 사항)
-        y = librosa.resample(y, orig_sr=sr, target_sr=self.sr)
+        with profiler.span('resample', audio_path):
+            y = self.resample(y, sr)
         print(f"{audio_path} - resampled - shape: {y.shape}, sr: {self.sr}")
         return y, self.sr
+
+
+class StreamingSpectralPreprocessor(BasePreprocessor):
+    """
+    SpectralPreprocessor over overlapping blocks, so peak memory stays within memory_budget
+    however long the file is.
+
+    Every block is processed with `margin` samples of context on both sides, which are dropped
+    after resampling. Block and margin lengths are multiples of the resampling period, so the
+    pieces line up sample exactly at the target rate. The spectral subtraction uses a running
+    noise estimate (mean of everything read so far) instead of the whole file mean, and the
+    normalization by the global peak is applied once at the end, on the resampled signal.
+    """
+    BYTES_PER_SAMPLE = 48  # rough peak of stft + istft + wavelet + resample copies per input sample
+    MARGIN_SECONDS = 0.25
+
+    def __init__(self, sr: float = 8000, memory_budget: int = 256 * 1024 ** 2):
+        super().__init__(sr)
+        self.memory_budget = memory_budget
+
+    def run(self, audio_path: str) -> tuple[np.ndarray, float]:
+        info = sf.info(audio_path)
+        orig_sr = info.samplerate
+        print(f"{audio_path} - frames: {info.frames}, sr: {orig_sr}, streaming")
+        core, _ = self.block_geometry(orig_sr)
+        blocks = (block.mean(axis=1) for block in
+                  sf.blocks(audio_path, blocksize=core, dtype='float32', always_2d=True))
+        y, sr = self.run_blocks(profiler.iterate('decode', audio_path, blocks), orig_sr, audio_path)
+        print(f"{audio_path} - resampled - shape: {y.shape}, sr: {self.sr}")
+        return y, sr
+
+    def peak_memory(self, frames: int, orig_sr: float) -> int:
+        # one block at a time, plus the resampled output collected over the whole file
+        return int(self.memory_budget + frames * self.sr / orig_sr * 8)
+
+    def block_geometry(self, orig_sr: int) -> tuple[int, int]:
+        """
+        :return: core block length, context margin length, both in input samples
+        """
+        period = orig_sr // gcd(int(orig_sr), int(self.sr))
+        margin = ceil(self.MARGIN_SECONDS * orig_sr / period) * period
+        core = (self.memory_budget // self.BYTES_PER_SAMPLE - 2 * margin) // period * period
+        return max(core, period), margin
+
+    def run_blocks(self, blocks, orig_sr: int, item: str = None) -> tuple[np.ndarray, float]:
+        """
+        :param blocks: iterable of mono float arrays of any length, in order
+        :param item: name of the stream in profiling spans
+        """
+        self.item = item
+        core, margin = self.block_geometry(orig_sr)
+        ratio = self.sr / orig_sr
+        hop = 512  # librosa.stft default
+
+        self._sample_sum, self._sample_count = 0.0, 0
+        self._phase_sum, self._frame_count = 0.0, 0
+        self._peak = 0.0
+        total_in, outputs = 0, []
+
+        buffer = np.empty(0, dtype=np.float32)
+        left = 0  # context samples at the start of buffer
+        for block in blocks:
+            total_in += len(block)
+            buffer = np.concatenate((buffer, block))
+            while len(buffer) >= left + core + margin:
+                segment = buffer[:left + core + margin]
+                outputs.append(self._process(segment, left, core, orig_sr, ratio, hop))
+                buffer = buffer[left + core - margin:]
+                left = margin
+
+        # tail without right context
+        if len(buffer) > left:
+            # the batch istft drops the last partial hop, keep the same length
+            total_out = ceil(total_in // hop * hop * ratio)
+            remaining = total_out - sum(len(out) for out in outputs)
+            outputs.append(self._process(buffer, left, len(buffer) - left, orig_sr, ratio, hop)[:remaining])
+
+        y = np.concatenate(outputs) if outputs else np.empty(0, dtype=np.float32)
+        # 정규화
+        return y / max(self._peak, 1e-10), self.sr
+
+    def _process(self, segment, left, core, orig_sr, ratio, hop):
+        core_samples = segment[left:left + core]
+        self._sample_sum += float(np.sum(core_samples, dtype=np.float64))
+        self._sample_count += len(core_samples)
+
+        # 노이즈 제거 (누적 노이즈 추정)
+        with profiler.span('denoise', self.item):
+            S = librosa.stft(segment)
+            _, phase = librosa.magphase(S[:, left // hop:(left + core) // hop + 1])
+            self._phase_sum = self._phase_sum + np.sum(phase, axis=1)
+            self._frame_count += phase.shape[1]
+            y = subtract_noise_spectrum(S, self._sample_sum / self._sample_count,
+                                        np.abs(self._phase_sum / self._frame_count), len(segment))
+
+        # 이산 웨이블릿 변환
+        with profiler.span('wavelet', self.item):
+            coeffs = pywt.wavedec(y, wavelet='db4', mode='per')
+            y = pywt.waverec(coeffs, wavelet='db4', mode='per')[:len(segment)]
+
+        # 음성 강조
+        with profiler.span('emphasis', self.item):
+            y = emphasize_audio(y)
+            self._peak = max(self._peak, float(np.max(np.abs(y[left:left + core]), initial=0.0)))
+
+        # 리샘플링
+        with profiler.span('resample', self.item):
+            y = librosa.resample(y, orig_sr=orig_sr, target_sr=self.sr)
+        start = int(round(left * ratio))
+        return y[start:start + int(round(core * ratio))]
+
+
+class PipedSpectralPreprocessor(StreamingSpectralPreprocessor):
+    """
+    StreamingSpectralPreprocessor fed by ffmpeg through a pipe, so the audio track of a video
+    (e.g. .mp4) is preprocessed without converting it to an audio file first.
+    ffmpeg only downmixes to mono float32 at the source rate; resampling stays in the preprocessor
+    so the output is the same as STREAM on the same decoded signal.
+    """
+
+    def run(self, video_path: str) -> tuple[np.ndarray, float]:
+        orig_sr = probe_sample_rate(video_path)
+        print(f"{video_path} - sr: {orig_sr}, piped from ffmpeg")
+        core, _ = self.block_geometry(orig_sr)
+        y, sr = self.run_blocks(profiler.iterate('decode', video_path, decode_blocks(video_path, core)),
+                                orig_sr, video_path)
+        print(f"{video_path} - resampled - shape: {y.shape}, sr: {self.sr}")
+        return y, sr
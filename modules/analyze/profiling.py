@@ -0,0 +1,141 @@
+import cProfile
+import csv
+import glob
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class Profiler:
+    """
+    Process local recorder of stage spans (wall and CPU time per stage and file) and counters
+    (DTW windows, bytes moved between processes, ...). Disabled, and nearly free, until configured.
+
+    Pool workers are configured by init_worker, and every process appends its records to its own
+    spans-<pid>.jsonl in the profile folder on flush, so nothing has to be sent back through the pool.
+    build_report then aggregates every process into report.json and report.csv.
+    Stages listed in cprofile_stages are also run under cProfile, dumped to <stage>-<pid>-<n>.prof.
+    """
+
+    def __init__(self):
+        self.folder = None
+        self.cprofile_stages = frozenset()
+        self.records = []
+        self.profile_count = 0
+
+    @property
+    def enabled(self):
+        return self.folder is not None
+
+    def configure(self, folder, cprofile_stages=(), clean=True):
+        """
+        :param clean: remove the records of a previous run, only the main process should
+        """
+        os.makedirs(folder, exist_ok=True)
+        if clean:
+            for old in glob.glob(os.path.join(folder, 'spans-*.jsonl')):
+                os.remove(old)
+        self.folder = folder
+        self.cprofile_stages = frozenset(cprofile_stages)
+        self.records = []
+
+    @contextmanager
+    def span(self, stage, item=None):
+        if not self.enabled:
+            yield
+            return
+        profile = cProfile.Profile() if stage in self.cprofile_stages else None
+        start, wall, cpu = time.time(), time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.profile_count += 1
+                profile.dump_stats(os.path.join(self.folder, f'{stage}-{os.getpid()}-{self.profile_count}.prof'))
+            self.records.append({'type': 'span', 'stage': stage, 'item': item, 'pid': os.getpid(), 'start': start,
+                                 'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu})
+
+    def iterate(self, stage, item, iterable):
+        """
+        Yields from iterable, recording the time spent producing every element as a span, e.g. for lazy decoding.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.span(stage, item):
+                try:
+                    element = next(iterator)
+                except StopIteration:
+                    return
+            yield element
+
+    def count(self, name, value=1, item=None):
+        if self.enabled:
+            self.records.append({'type': 'count', 'name': name, 'item': item, 'pid': os.getpid(), 'value': value})
+
+    def flush(self):
+        if not self.enabled or not self.records:
+            return
+        with open(os.path.join(self.folder, f'spans-{os.getpid()}.jsonl'), 'a') as f:
+            for record in self.records:
+                f.write(json.dumps(record) + '\n')
+        self.records = []
+
+
+profiler = Profiler()
+
+
+def build_report(folder):
+    """
+    Aggregates the records of every process. Spans of the same stage and item (e.g. the blocks of a streamed
+    file) are summed first, so percentiles are over files or pairs rather than over individual calls.
+    Writes report.json and report.csv (one row per stage) to folder.
+    :return: the report dict
+    """
+    per_item = {}
+    counters = {}
+    for path in glob.glob(os.path.join(folder, 'spans-*.jsonl')):
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record['type'] == 'count':
+                    counters[record['name']] = counters.get(record['name'], 0) + record['value']
+                    continue
+                totals = per_item.setdefault(record['stage'], {}).setdefault(record['item'], [0, 0.0, 0.0])
+                totals[0] += 1
+                totals[1] += record['wall']
+                totals[2] += record['cpu']
+
+    stages = {}
+    for stage, items in per_item.items():
+        calls, wall, cpu = (np.array(column) for column in zip(*items.values()))
+        p50, p90, p99 = np.percentile(wall, [50, 90, 99])
+        stages[stage] = {'calls': int(calls.sum()), 'items': len(items),
+                         'wall_total': float(wall.sum()), 'cpu_total': float(cpu.sum()),
+                         'wall_p50': float(p50), 'wall_p90': float(p90), 'wall_p99': float(p99),
+                         'wall_max': float(wall.max())}
+
+    report = {'stages': stages, 'counters': counters}
+    with open(os.path.join(folder, 'report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    with open(os.path.join(folder, 'report.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        columns = ['calls', 'items', 'wall_total', 'cpu_total', 'wall_p50', 'wall_p90', 'wall_p99', 'wall_max']
+        writer.writerow(['stage'] + columns)
+        for stage, row in sorted(stages.items(), key=lambda entry: -entry[1]['wall_total']):
+            writer.writerow([stage] + [row[column] for column in columns])
+    return report
+
+
+def print_report(report):
+    print("Profile (wall seconds per file or pair):")
+    for stage, row in sorted(report['stages'].items(), key=lambda entry: -entry[1]['wall_total']):
+        print(f"  {stage:<10} items {row['items']:>5}  total {row['wall_total']:9.2f}s  cpu {row['cpu_total']:9.2f}s  "
+              f"p50 {row['wall_p50']:7.3f}s  p90 {row['wall_p90']:7.3f}s  p99 {row['wall_p99']:7.3f}s")
+    for name, value in sorted(report['counters'].items()):
+        print(f"  {name}: {value}")
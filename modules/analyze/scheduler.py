@@ -0,0 +1,174 @@
+import os
+import time
+import multiprocessing as mp
+
+import soundfile as sf
+
+from ..ffmpeg import probe_stream
+
+COMPRESSED_BYTES_PER_SECOND = 16000  # 128 kbps, to guess the duration of files nothing could probe
+
+
+def available_memory():
+    """
+    :return: bytes of memory available to new processes
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+
+
+def probe_frames(file_path):
+    """
+    Length of a media file from its headers only: soundfile for audio files, ffprobe for the rest (e.g. .mp4),
+    and the file size as a last resort.
+    :return: (samples per channel, sample rate)
+    """
+    try:
+        info = sf.info(file_path)
+        return info.frames, info.samplerate
+    except (RuntimeError, OSError):
+        pass
+    try:
+        sample_rate, duration = probe_stream(file_path)
+        if duration is not None:
+            return int(duration * sample_rate), sample_rate
+    except (RuntimeError, OSError):
+        sample_rate = 44100
+    return int(os.path.getsize(file_path) / COMPRESSED_BYTES_PER_SECOND * sample_rate), sample_rate
+
+
+def _run_tracked(marker_folder, key, func, args):
+    # the marker names the task of this worker until it returns, so the scheduler can tell which task
+    # was lost when the worker is killed (e.g. by the OOM killer) and never reports back
+    marker = os.path.join(marker_folder, str(os.getpid()))
+    with open(marker, 'w') as f:
+        f.write(repr(key))
+    try:
+        return func(*args)
+    finally:
+        os.remove(marker)
+
+
+class AdmissionScheduler:
+    """
+    Feeds tasks to a pool in descending order of estimated peak memory, so the longest files start first and
+    do not make up the tail, and only while the estimates of the running tasks fit in memory_budget.
+    A task larger than the whole budget still runs, alone.
+
+    A task that raised MemoryError, or whose worker died without returning, is retried up to `retries` times
+    with its estimate raised to the whole budget, i.e. with no neighbours, instead of failing the run.
+    Other exceptions are returned to the caller, which decides what to skip.
+    """
+
+    def __init__(self, pool, memory_budget=None, slots=None, retries=2, marker_folder=None, poll_seconds=0.05):
+        """
+        :param memory_budget: bytes. None admits everything at once
+        :param slots: maximum tasks in the pool at once, e.g. its process count. None for no limit
+        :param marker_folder: folder to detect dead local workers through. None disables the detection,
+                              e.g. when the pool is not made of child processes of this one
+        """
+        self.pool = pool
+        self.memory_budget = memory_budget
+        self.slots = slots
+        self.retries = retries
+        self.marker_folder = marker_folder
+        self.poll_seconds = poll_seconds
+        if marker_folder is not None:
+            os.makedirs(marker_folder, exist_ok=True)
+        self.queued = []  # [key, func, args, memory, attempts], sorted by descending memory on admission
+        self.running = {}  # key: (async result, memory, task)
+        self.done = {}  # key: (result, error) not yet handed out
+        self.lost = 0
+        self.last_check = 0.0
+
+    @property
+    def used_memory(self):
+        return sum(memory for _, memory, _ in self.running.values())
+
+    def submit(self, key, func, args, memory=0):
+        self.queued.append([key, func, args, memory, 0])
+
+    def as_completed(self, keys):
+        """
+        :return: generator of (key, result, error) for the given keys in completion order.
+                 error is None on success, the exception otherwise
+        """
+        keys = set(keys)
+        while keys:
+            self._admit()
+            self._poll()
+            finished = [key for key in keys if key in self.done]
+            for key in finished:
+                keys.discard(key)
+                result, error = self.done.pop(key)
+                yield key, result, error
+            if not finished:
+                time.sleep(self.poll_seconds)
+
+    def _admit(self):
+        self.queued.sort(key=lambda task: -task[3])
+        for task in list(self.queued):
+            if self.slots is not None and len(self.running) >= self.slots:
+                return
+            memory = task[3]
+            if self.memory_budget is not None and self.running and self.used_memory + memory > self.memory_budget:
+                continue
+            self.queued.remove(task)
+            key, func, args = task[:3]
+            if self.marker_folder is not None:
+                func, args = _run_tracked, (self.marker_folder, key, func, args)
+            self.running[key] = (self.pool.apply_async(func, args), memory, task)
+
+    def _poll(self):
+        for key, (async_result, _, task) in list(self.running.items()):
+            if not async_result.ready():
+                continue
+            del self.running[key]
+            try:
+                self.done[key] = (async_result.get(), None)
+            except MemoryError as e:
+                self._retry(task, e)
+            except Exception as e:
+                self.done[key] = (None, e)
+        if self.marker_folder is not None and time.time() - self.last_check > 0.5:
+            self.last_check = time.time()
+            self._check_workers()
+
+    def _check_workers(self):
+        # listed before the live workers, so a marker of a worker started in between is not mistaken for a dead one
+        names = os.listdir(self.marker_folder)
+        alive = {str(process.pid) for process in mp.active_children()}
+        for name in names:
+            if name in alive:
+                continue
+            path = os.path.join(self.marker_folder, name)
+            try:
+                with open(path) as f:
+                    marker = f.read()
+                os.remove(path)
+            except OSError:
+                continue
+            for key, (async_result, _, task) in list(self.running.items()):
+                # the worker may have returned right before the check, then its result is ready
+                if repr(key) == marker and not async_result.ready():
+                    del self.running[key]
+                    self.lost += 1
+                    self._retry(task, MemoryError(f'worker {name} died running {marker}, probably out of memory'))
+
+    def _retry(self, task, error):
+        key = task[0]
+        if task[4] >= self.retries:
+            self.done[key] = (None, error)
+            return
+        print(f"[WARN] {key} ran out of memory ({error}). Retrying alone "
+              f"({task[4] + 1} of {self.retries})")
+        task[4] += 1
+        if self.memory_budget is not None:
+            task[3] = max(task[3], self.memory_budget)
+        self.queued.append(task)
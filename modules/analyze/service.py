@@ -0,0 +1,338 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import multiprocessing as mp
+
+import numpy as np
+
+from . import PREPROCESS_MODE, _extract
+from .cache import content_hash
+from .fingerprint import FingerprintIndex
+from .matching import MatchingManager
+from ..ffmpeg import is_partial_file
+
+PCM_FORMATS = {'f32': np.float32, 's16': np.int16}
+
+
+def _extract_song(song_path, sr, cache, fingerprint, preprocess_mode, preprocess_options):
+    """
+    Catalog task: features (and landmarks) of one song.
+    :return: (song_path, (features, hopped_sr) or None on failure, (version, hashes, times) or None)
+    """
+    try:
+        features, landmarks = _extract(song_path, sr, cache, fingerprint, preprocess_mode, preprocess_options)
+    except Exception as e:
+        print(f'[ERROR] Feature extraction of {song_path} failed. Skip. Traceback:')
+        print(e)
+        return song_path, None, None
+    if fingerprint:
+        version = cache.file_version(song_path) if cache is not None else content_hash(song_path)
+        landmarks = (version, *landmarks)
+    return song_path, features, landmarks
+
+
+class LatencyRecorder:
+    """
+    Keeps the last `size` latencies of every stage for percentile reports.
+    """
+
+    def __init__(self, size=10000):
+        self.size = size
+        self.samples = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, deque(maxlen=self.size)).append(seconds)
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def summary(self):
+        """
+        :return: {stage: {count, p50, p90, p99, max}} in milliseconds, over the kept latencies
+        """
+        with self.lock:
+            samples = {stage: np.array(values) * 1000 for stage, values in self.samples.items()}
+            counts = dict(self.counts)
+        return {stage: {'count': counts[stage],
+                        **{f'p{q}': round(float(np.percentile(values, q)), 2) for q in (50, 90, 99)},
+                        'max': round(float(values.max()), 2)}
+                for stage, values in samples.items()}
+
+
+class SongCatalog:
+    """
+    Features of every song of audio_folder held in memory, and with fingerprint_top a landmark index of them.
+    refresh() picks up added, changed and removed songs and swaps in a new snapshot at once,
+    so queries running meanwhile keep the snapshot they started with.
+    """
+
+    def __init__(self, audio_folder, sr, cache=None, fingerprint_top=0,
+                 preprocess_mode=PREPROCESS_MODE, preprocess_options=None, processes=None):
+        """
+        :param cache: FeatureCache the songs are loaded from and extracted into. None extracts every song
+        :param processes: pool size of the extraction of several new songs, 80% of the cores by default
+        """
+        self.audio_folder = audio_folder
+        self.sr = sr
+        self.cache = cache
+        self.fingerprint_top = fingerprint_top
+        self.preprocess_mode = preprocess_mode
+        self.preprocess_options = preprocess_options or {}
+        self.processes = processes
+        self.songs = {}  # song path: (features, hopped_sr)
+        self.signatures = {}  # song path: (size, mtime) the features were extracted from
+        self.failed = {}  # song path: (size, mtime) whose extraction failed, skipped until the file changes
+        self.index = FingerprintIndex() if fingerprint_top > 0 else None
+        self.index_lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def scan(self):
+        """
+        :return: {song path: (size, mtime)} of the songs currently in audio_folder
+        """
+        signatures = {}
+        for name in os.listdir(self.audio_folder):
+            song_path = os.path.join(self.audio_folder, name)
+            if is_partial_file(name) or not os.path.isfile(song_path):
+                continue
+            stat = os.stat(song_path)
+            signatures[song_path] = (stat.st_size, stat.st_mtime_ns)
+        return signatures
+
+    def refresh(self):
+        """
+        Extracts the new and changed songs and drops the removed ones.
+        A song whose extraction failed is not tried again until its size or mtime changes.
+        :return: (added or changed song paths, removed song paths)
+        """
+        with self.refresh_lock:
+            signatures = self.scan()
+            changed = sorted(song_path for song_path, signature in signatures.items()
+                             if self.signatures.get(song_path) != signature
+                             and self.failed.get(song_path) != signature)
+            removed = sorted(set(self.signatures) - set(signatures))
+            if not changed and not removed:
+                return [], []
+
+            songs = {song_path: features for song_path, features in self.songs.items() if song_path in signatures}
+            st = time.time()
+            self.failed = {song_path: signature for song_path, signature in self.failed.items()
+                           if signatures.get(song_path) == signature}
+            for song_path, features, landmarks in self._extract(changed):
+                if features is None:
+                    songs.pop(song_path, None)
+                    self.failed[song_path] = signatures[song_path]
+                    continue
+                songs[song_path] = features
+                self.failed.pop(song_path, None)
+                if landmarks is not None:
+                    with self.index_lock:
+                        self.index.add(song_path, *landmarks)
+            self.signatures = {song_path: signatures[song_path] for song_path in songs}
+            self.songs = songs
+            print(f"Song catalog: {len(changed)} added or changed, {len(removed)} removed, "
+                  f"{len(songs)} songs in memory ({time.time() - st:.2f}s)")
+            return changed, removed
+
+    def _extract(self, song_paths):
+        args = [(song_path, self.sr, self.cache, self.index is not None, self.preprocess_mode, self.preprocess_options)
+                for song_path in song_paths]
+        if len(args) <= 1:
+            return [_extract_song(*arg) for arg in args]
+        processes = min(self.processes or max(int(mp.cpu_count() * 0.8), 1), len(args))
+        # refreshes run next to the server threads, and forking a process with live threads can deadlock
+        # the children on locks held at fork time
+        with mp.get_context('spawn').Pool(processes) as pool:
+            return pool.starmap(_extract_song, args)
+
+    def candidates(self, landmarks, songs):
+        """
+        :return: paths of the fingerprint_top songs with the most landmark votes, every song without an index
+        """
+        if self.index is None or landmarks is None:
+            return list(songs)
+        with self.index_lock:
+            # removed songs stay in the index, the snapshot decides what still exists
+            ranked = self.index.query(*landmarks, top=len(self.index.song_paths))
+        return [song_path for song_path, _, _ in ranked if song_path in songs][:self.fingerprint_top]
+
+    def watch(self, interval):
+        """
+        Refreshes the catalog every `interval` seconds in a daemon thread.
+        """
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print('[ERROR] Song catalog reload failed. Traceback:')
+                    print(e)
+
+        thread = threading.Thread(target=loop, name='catalog-watch', daemon=True)
+        thread.start()
+        return thread
+
+
+class MatchService:
+    """
+    Matches clips against a SongCatalog like episodes, segments being positions in the clip.
+    Thread safe, one call per request.
+    """
+
+    def __init__(self, catalog, th, mode, match_options=None):
+        self.catalog = catalog
+        self.th = th
+        self.mode = mode
+        self.match_options = match_options or {}
+        self.latency = LatencyRecorder()
+
+    def match_file(self, clip_path, th=None, mode=None):
+        """
+        :return: {clip, seconds, candidates, matches: [{song, path, segments}], timing}
+        """
+        catalog = self.catalog
+        st = time.perf_counter()
+        (features, sr), landmarks = _extract(clip_path, catalog.sr, None, catalog.index is not None,
+                                             catalog.preprocess_mode, catalog.preprocess_options)
+        preprocessed = time.perf_counter()
+        songs = catalog.songs
+        candidates = catalog.candidates(landmarks, songs)
+        matches = self._match(features, sr, songs, candidates,
+                              self.th if th is None else th, self.mode if mode is None else mode)
+        matched = time.perf_counter()
+        self.latency.record('preprocess', preprocessed - st)
+        self.latency.record('match', matched - preprocessed)
+        return {'clip': clip_path, 'seconds': features.shape[1] / sr, 'candidates': len(candidates),
+                'matches': matches,
+                'timing': {'preprocess': preprocessed - st, 'match': matched - preprocessed, 'total': matched - st}}
+
+    def match_pcm(self, pcm, orig_sr, th=None, mode=None):
+        """
+        Raw mono PCM goes through a temporary WAV file, so it is preprocessed exactly like the songs.
+        :param pcm: (samples,) float32 in [-1, 1] or int16
+        """
+        import soundfile as sf
+
+        folder = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        fd, clip_path = tempfile.mkstemp(prefix='where-is-the-song-clip-', suffix='.wav', dir=folder)
+        os.close(fd)
+        try:
+            sf.write(clip_path, pcm, orig_sr, subtype='FLOAT' if pcm.dtype == np.float32 else 'PCM_16')
+            result = self.match_file(clip_path, th, mode)
+        finally:
+            os.remove(clip_path)
+        result['clip'] = 'pcm'
+        return result
+
+    def _match(self, features, sr, songs, candidates, th, mode):
+        if not candidates:
+            return []
+        matcher = MatchingManager(mode, sr=sr, th=th, **self.match_options)
+        matches = matcher.run_batch(features, [songs[song_path][0] for song_path in candidates],
+                                    names=[os.path.splitext(os.path.basename(song_path))[0]
+                                           for song_path in candidates])
+        return [{'song': os.path.splitext(os.path.basename(song_path))[0], 'path': song_path,
+                 'segments': [list(segment) for segment in segments]}
+                for song_path, (is_matched, segments) in zip(candidates, matches) if is_matched]
+
+
+class MatchRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /songs    songs in memory
+    GET  /metrics  latency percentiles per endpoint and stage
+    POST /reload   refresh the catalog now
+    POST /match    JSON {"path": clip path, "th": optional, "mode": optional}, or a raw mono PCM body
+                   (Content-Type: application/octet-stream) with ?sr=<rate>&format=f32|s16&th=&mode=
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        route = urlparse(self.path).path
+        if route == '/songs':
+            songs = self.server.service.catalog.songs
+            self._timed(route, lambda: {'songs': sorted(songs)})
+        elif route == '/metrics':
+            self._send(200, {'latency_ms': self.server.service.latency.summary(),
+                             'songs': len(self.server.service.catalog.songs)})
+        else:
+            self._send(404, {'error': f'unknown route {route}'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path == '/reload':
+            self._timed(url.path, lambda: dict(zip(('changed', 'removed'), self.server.service.catalog.refresh())))
+        elif url.path == '/match':
+            self._timed(url.path, lambda: self._match(body, parse_qs(url.query)))
+        else:
+            self._send(404, {'error': f'unknown route {url.path}'})
+
+    def _match(self, body, query):
+        service = self.server.service
+        if self.headers.get('Content-Type', '').startswith('application/octet-stream'):
+            if 'sr' not in query:
+                raise ValueError('raw PCM needs ?sr=<sampling rate>')
+            pcm_format = query.get('format', ['f32'])[0]
+            if pcm_format not in PCM_FORMATS:
+                raise ValueError(f'format must be one of {sorted(PCM_FORMATS)}')
+            options = {name: values[0] for name, values in query.items() if name in ('th', 'mode')}
+            pcm = np.frombuffer(body, dtype=PCM_FORMATS[pcm_format])
+            return service.match_pcm(pcm, int(query['sr'][0]), *self._options(options))
+        options = json.loads(body or b'{}')
+        if not os.path.isfile(options.get('path', '')):
+            raise FileNotFoundError(f"no clip at {options.get('path')!r}")
+        return service.match_file(options['path'], *self._options(options))
+
+    @staticmethod
+    def _options(options):
+        return (float(options['th']) if 'th' in options else None,
+                int(options['mode']) if 'mode' in options else None)
+
+    def _timed(self, route, handle):
+        st = time.perf_counter()
+        try:
+            status, payload = 200, handle()
+        except FileNotFoundError as e:
+            status, payload = 404, {'error': str(e)}
+        except (ValueError, KeyError) as e:
+            status, payload = 400, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': repr(e)}
+        self.server.service.latency.record(f'{self.command} {route}', time.perf_counter() - st)
+        self._send(status, payload)
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} {format % args}")
+
+
+def serve(service, host='127.0.0.1', port=8765):
+    """
+    Serves MatchService over HTTP until interrupted, each request in a thread of its own.
+    """
+    server = ThreadingHTTPServer((host, port), MatchRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"Match service listening on http://{host}:{server.server_address[1]} "
+          f"with {len(service.catalog.songs)} songs")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
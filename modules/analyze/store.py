@@ -0,0 +1,126 @@
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import NamedTuple
+
+import numpy as np
+
+
+FEATURE_DTYPES = ('float32', 'float16', 'int8')
+
+
+class FeatureHandle(NamedTuple):
+    path: str
+    sr: float
+    nbytes: int
+    scale_path: str = None
+    frames: int = 0
+
+
+def quantize(frames: np.ndarray, dtype: str = 'float32') -> tuple[np.ndarray, np.ndarray]:
+    """
+    :param frames: features of shape (frames, features)
+    :return: contiguous data in dtype, (2, features) per channel scale and offset for int8 or None
+    """
+    if dtype == 'float32':
+        return np.ascontiguousarray(frames, dtype=np.float32), None
+    if dtype == 'float16':
+        return np.ascontiguousarray(frames, dtype=np.float16), None
+    if dtype == 'int8':
+        # channels are far from zero centered (e.g. MFCC 0), so each gets its own offset as well as a scale
+        low, high = frames.min(axis=0), frames.max(axis=0)
+        offset = (high + low) / 2
+        scale = np.maximum((high - low) / 254, 1e-10)
+        data = np.clip(np.rint((frames - offset) / scale), -127, 127).astype(np.int8)
+        return data, np.stack([scale, offset]).astype(np.float32)
+    raise ValueError(f"Invalid feature dtype : {dtype}")
+
+
+def dequantize(data: np.ndarray, scale: np.ndarray = None) -> np.ndarray:
+    """
+    :return: float32 (frames, features), data itself when it already is float32
+    """
+    if scale is not None:
+        return data.astype(np.float32) * scale[0] + scale[1]
+    return data if data.dtype == np.float32 else data.astype(np.float32)
+
+
+class SharedFeatureStore:
+    """
+    Run-scoped store that publishes feature matrices as .npy files on a RAM backed filesystem
+    (/dev/shm when available). Workers attach them with np.load(mmap_mode='r'), so every
+    worker matching against the same episode reads the same physical pages instead of getting
+    its own pickled copy through a manager process.
+
+    Matrices are stored frames-major and contiguous, the layout every matcher slices windows from.
+    float16 and int8 (with a per channel scale) halve or quarter the store, at the cost of one
+    float32 copy per attach and a small loss of precision. float32 attaches without any copy.
+
+    /dev/shm can be much smaller than the features of a run (64 MB in a docker container by default).
+    When it fills up, the default store moves on to a folder in the regular temporary directory,
+    and matrices published before stay where they are.
+    """
+
+    def __init__(self, root=None, dtype='float32'):
+        if dtype not in FEATURE_DTYPES:
+            raise ValueError(f"Invalid feature dtype : {dtype}")
+        self.can_fall_back = root is None and os.path.isdir('/dev/shm')
+        if self.can_fall_back:
+            root = '/dev/shm'
+        self.folder = tempfile.mkdtemp(prefix='where-is-the-song-', dir=root)
+        self.folders = [self.folder]
+        self.dtype = dtype
+
+    def publish(self, file_path, features, sr) -> FeatureHandle:
+        """
+        :param features: (features, frames) as returned by the feature extractors
+        """
+        name = hashlib.sha1(file_path.encode('utf-8')).hexdigest()
+        data, scale = quantize(features.T, self.dtype)
+        path = self._save(f'{name}.npy', data)
+        scale_path = self._save(f'{name}.scale.npy', scale) if scale is not None else None
+        return FeatureHandle(path, float(sr), data.nbytes + (scale.nbytes if scale is not None else 0), scale_path,
+                             len(data))
+
+    def _save(self, name, array):
+        path = os.path.join(self.folder, name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, array)
+        except OSError as e:
+            os.remove(tmp_path)
+            if e.errno != errno.ENOSPC or not self.can_fall_back:
+                raise
+            self._fall_back()
+            return self._save(name, array)
+        os.replace(tmp_path, path)
+        return path
+
+    def _fall_back(self):
+        self.can_fall_back = False
+        self.folder = tempfile.mkdtemp(prefix='where-is-the-song-')
+        self.folders.append(self.folder)
+        print(f"/dev/shm is full, publishing the next features to {self.folder}")
+
+    @staticmethod
+    def attach(handle: FeatureHandle) -> tuple[np.ndarray, float]:
+        """
+        :return: (features, hopped_sr). features is a (features, frames) view of the frames-major data,
+                 read-only memory mapped for float32
+        """
+        data = np.load(handle.path, mmap_mode='r')
+        scale = np.load(handle.scale_path) if handle.scale_path is not None else None
+        return dequantize(data, scale).T, handle.sr
+
+    def close(self):
+        for folder in self.folders:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,31 @@
+"""
+Preloaded by the forkserver of VideoAudioMatchRunner(start_method='forkserver'). Importing it loads the whole
+analysis package and, when WARMUP_ENV describes the run, fills the librosa filterbank caches and compiles
+its JIT kernels once, so every worker forked from the server starts with them instead of paying for it.
+"""
+import json
+import os
+
+from . import FEATURE_MODE, WARMUP_ENV
+from .feature import FeatureManager
+from .matching import MatchingManager
+
+
+def warm_up(sr, mode, feature_mode=FEATURE_MODE):
+    """
+    :param sr: analysis sampling rate of the run
+    :param mode: MatchingManager.ModeEnum of the run
+    """
+    import librosa
+    import numpy as np
+
+    y = np.random.default_rng(0).standard_normal(22050 * 4).astype(np.float32)
+    y = librosa.resample(y, orig_sr=22050, target_sr=sr)
+    FeatureManager(feature_mode, sr=sr).run(y)
+    if mode in (MatchingManager.ModeEnum.BASIC, MatchingManager.ModeEnum.MULTI, MatchingManager.ModeEnum.MULTG):
+        import fastdtw
+        import scipy.spatial.distance
+
+
+if WARMUP_ENV in os.environ:
+    warm_up(**json.loads(os.environ[WARMUP_ENV]))
@@ -0,0 +1,256 @@
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+import multiprocessing as mp
+
+
+class WorkQueue:
+    """
+    Job queue in a SQLite file, so any machine that can open the file (e.g. on shared storage) can pull from it.
+
+    A job is a pickled (function, args) pair. Workers claim the oldest pending job with a lease and
+    renew the lease while it runs. A job whose lease ran out (its worker crashed or lost the storage)
+    is claimed again by the next worker, up to max_attempts times, then marked failed.
+    """
+
+    def __init__(self, path, lease_seconds=60, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result BLOB,
+                error TEXT
+            )''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)')
+
+    def submit(self, run, func, args):
+        return self.submit_many(run, func, [args])[0]
+
+    def submit_many(self, run, func, args_list):
+        """
+        :return: job ids, in the order of args_list
+        """
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            job_ids = [self.connection.execute('INSERT INTO jobs (run, payload) VALUES (?, ?)',
+                                               (run, pickle.dumps((func, args)))).lastrowid for args in args_list]
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        return job_ids
+
+    def claim(self, owner):
+        """
+        :return: (job id, func, args) or None when nothing is claimable
+        """
+        now = time.time()
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            # expired leases that used up their attempts are settled first
+            self.connection.execute("UPDATE jobs SET state = 'failed', error = 'lease expired ' || attempts || ' times' "
+                                    "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                                    (now, self.max_attempts))
+            row = self.connection.execute("SELECT id, payload FROM jobs WHERE state = 'pending' "
+                                          "OR (state = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                                          (now,)).fetchone()
+            if row is not None:
+                self.connection.execute("UPDATE jobs SET state = 'leased', owner = ?, lease_expires = ?, "
+                                        "attempts = attempts + 1 WHERE id = ?",
+                                        (owner, now + self.lease_seconds, row[0]))
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        func, args = pickle.loads(row[1])
+        return row[0], func, args
+
+    def renew(self, job_id, owner):
+        self.connection.execute("UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                                (time.time() + self.lease_seconds, job_id, owner))
+
+    def complete(self, job_id, owner, result=None, error=None):
+        # a worker whose lease was taken over in the meantime must not overwrite the new owner
+        self.connection.execute("UPDATE jobs SET state = ?, result = ?, error = ? "
+                                "WHERE id = ? AND owner = ? AND state = 'leased'",
+                                ('failed' if error is not None else 'done',
+                                 pickle.dumps(result) if error is None else None, error, job_id, owner))
+
+    def finished(self, job_ids):
+        """
+        :return: [(job id, state, result, error)] of the given jobs that are done or failed
+        """
+        job_ids = list(job_ids)
+        rows = []
+        for first in range(0, len(job_ids), 500):
+            chunk = job_ids[first:first + 500]
+            rows += self.connection.execute(
+                f"SELECT id, state, result, error FROM jobs WHERE state IN ('done', 'failed') "
+                f"AND id IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+        return rows
+
+    def finished_in_run(self, run):
+        """
+        :return: ids of the done or failed jobs of run
+        """
+        return {job_id for job_id, in self.connection.execute(
+            "SELECT id FROM jobs WHERE run = ? AND state IN ('done', 'failed')", (run,))}
+
+    def delete_run(self, run):
+        self.connection.execute('DELETE FROM jobs WHERE run = ?', (run,))
+
+    def close(self):
+        self.connection.close()
+
+
+class QueueAsyncResult:
+    def __init__(self, executor, job_id):
+        self.executor = executor
+        self.job_id = job_id
+
+    def ready(self):
+        return self.executor.ready(self.job_id)
+
+    def get(self):
+        return self.executor.wait(self.job_id)
+
+
+class QueueExecutor:
+    """
+    Coordinator side of the WorkQueue, with the part of the mp.Pool interface the runner uses
+    (apply_async with ready / get results, imap_unordered, close, join), so it can replace the local pool.
+    Jobs are only run by workers (run_worker), on this machine or any other.
+    """
+
+    def __init__(self, queue_path, poll_seconds=0.5, **queue_options):
+        self.queue = WorkQueue(queue_path, **queue_options)
+        self.run = uuid.uuid4().hex
+        self.poll_seconds = poll_seconds
+        self.finished_ids = set()
+        self.last_refresh = 0.0
+
+    def apply_async(self, func, args=()):
+        return QueueAsyncResult(self, self.queue.submit(self.run, func, args))
+
+    def imap_unordered(self, func, iterable):
+        # submitted right away like mp.Pool, only collecting the results is lazy
+        return self._collect(set(self.queue.submit_many(self.run, func, [(args,) for args in iterable])))
+
+    def _collect(self, remaining):
+        while remaining:
+            rows = self.queue.finished(remaining)
+            for job_id, state, result, error in rows:
+                remaining.discard(job_id)
+                yield self._result(state, result, error)
+            if not rows:
+                time.sleep(self.poll_seconds)
+
+    def ready(self, job_id):
+        # one query for every job of the run, at most once per poll interval, however many results are polled
+        if job_id not in self.finished_ids and time.time() - self.last_refresh > self.poll_seconds:
+            self.last_refresh = time.time()
+            self.finished_ids = self.queue.finished_in_run(self.run)
+        return job_id in self.finished_ids
+
+    def wait(self, job_id):
+        while True:
+            rows = self.queue.finished([job_id])
+            if rows:
+                _, state, result, error = rows[0]
+                return self._result(state, result, error)
+            time.sleep(self.poll_seconds)
+
+    @staticmethod
+    def _result(state, result, error):
+        if state == 'failed':
+            raise RuntimeError(f'Job failed on a worker: {error}')
+        return pickle.loads(result)
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.queue.delete_run(self.run)
+        self.queue.close()
+
+
+def _renew_lease(queue_path, job_id, owner, lease_seconds, stop):
+    queue = WorkQueue(queue_path, lease_seconds=lease_seconds)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            queue.renew(job_id, owner)
+    finally:
+        queue.close()
+
+
+def worker_loop(queue_path, lease_seconds=60, poll_seconds=1.0, idle_exit=None, initializer=None, initargs=()):
+    """
+    Claims and runs jobs until interrupted, or until the queue stayed empty for idle_exit seconds.
+    :param initializer: called with initargs once before the first job, as in mp.Pool
+    """
+    if initializer is not None:
+        initializer(*initargs)
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+    queue = WorkQueue(queue_path, lease_seconds=lease_seconds)
+    idle_since = time.time()
+    try:
+        while True:
+            job = queue.claim(owner)
+            if job is None:
+                if idle_exit is not None and time.time() - idle_since > idle_exit:
+                    return
+                time.sleep(poll_seconds)
+                continue
+            job_id, func, args = job
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=_renew_lease, args=(queue_path, job_id, owner, lease_seconds, stop),
+                                         daemon=True)
+            heartbeat.start()
+            try:
+                result = func(*args)
+                queue.complete(job_id, owner, result=result)
+            except Exception:
+                queue.complete(job_id, owner, error=traceback.format_exc())
+            finally:
+                stop.set()
+                heartbeat.join()
+            idle_since = time.time()
+    finally:
+        queue.close()
+
+
+def run_worker(queue_path, processes=None, lease_seconds=60, idle_exit=None, initializer=None, initargs=()):
+    """
+    Runs `processes` worker loops (80% of the cores by default) on this machine.
+    """
+    processes = processes or max(int(mp.cpu_count() * 0.8), 1)
+    print(f'Worker on {socket.gethostname()} pulling from {queue_path} with {processes} processes')
+    workers = [mp.Process(target=worker_loop,
+                          args=(queue_path, lease_seconds, 1.0, idle_exit, initializer, initargs))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
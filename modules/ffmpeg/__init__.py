@@ -1 +1,2 @@
-from .video_to_audio import video_to_audio
+from .video_to_audio import OUTPUT_FORMATS, convert_file, is_partial_file, video_to_audio
+from .pipe import decode_blocks, probe_sample_rate, probe_stream
@@ -0,0 +1,71 @@
+import subprocess
+
+
+def probe_sample_rate(input_path):
+    """
+    :return: sample rate of the first audio stream of input_path
+    """
+    return probe_stream(input_path)[0]
+
+
+def probe_stream(input_path):
+    """
+    Reads the container headers only, nothing is decoded.
+    :return: (sample rate of the first audio stream, duration in seconds or None when unknown)
+    """
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries',
+               'stream=sample_rate:format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', input_path]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0 or not result.stdout.strip():
+        raise RuntimeError(f"ffprobe found no audio stream in {input_path}: "
+                           f"{result.stderr.decode('utf-8', errors='replace').strip()}")
+    values = result.stdout.split()
+    try:
+        duration = float(values[1])
+    except (IndexError, ValueError):
+        duration = None
+    return int(values[0]), duration
+
+
+def decode_blocks(input_path, block_samples, sr=None):
+    """
+    Decodes the audio track of input_path (any container ffmpeg reads, e.g. .mp4) to mono float32
+    through a stdout pipe, so nothing is written to disk.
+    :param block_samples: samples per yielded block, the last one may be shorter
+    :param sr: output sample rate, None keeps the source rate
+    :return: generator of (samples,) float32 arrays
+    """
+    # only the PIPE preprocessor needs numpy here, conversion runs without it
+    import numpy as np
+
+    command = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', input_path, '-vn', '-ac', '1']
+    if sr is not None:
+        command += ['-ar', str(int(sr))]
+    command += ['-f', 'f32le', '-acodec', 'pcm_f32le', 'pipe:1']
+
+    block_bytes = block_samples * 4
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        pending = b''
+        while True:
+            chunk = process.stdout.read(block_bytes - len(pending))
+            if not chunk:
+                break
+            pending += chunk
+            if len(pending) == block_bytes:
+                yield np.frombuffer(pending, dtype=np.float32)
+                pending = b''
+        # a partial float at the very end can only come from a truncated stream
+        usable = len(pending) // 4 * 4
+        if usable:
+            yield np.frombuffer(pending[:usable], dtype=np.float32)
+
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed decoding {input_path}: {stderr.decode('utf-8', errors='replace').strip()}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
@@ -1,17 +1,98 @@
 import os
 import subprocess
+import time
+from multiprocessing.pool import ThreadPool
 
+PART_SUFFIX = '.part'
 
-def video_to_audio(video_folder, converted_folder):
-    for video_file in os.listdir(video_folder):
-        if video_file.endswith('.mp4'):
+# format name: (extension, ffmpeg muxer, whether the output is resampled to the analysis rate, codec arguments)
+OUTPUT_FORMATS = {
+    'mp3': ('.mp3', 'mp3', False, ['-acodec', 'libmp3lame', '-ac', '2', '-qscale:a', '4']),
+    'wav': ('.wav', 'wav', True, ['-acodec', 'pcm_s16le', '-ac', '1']),
+    'wav32': ('.wav', 'wav', True, ['-acodec', 'pcm_f32le', '-ac', '1']),
+}
+
+
+def is_partial_file(file_name):
+    """
+    Hidden files and unfinished conversions, which must never be picked up as converted audio.
+    """
+    return file_name.startswith('.') or file_name.endswith(PART_SUFFIX)
+
+
+def convert_file(input_path, output_path, output_format='mp3', sr=None):
+    """
+    Runs one ffmpeg process into output_path + '.part' and renames it on success, so an interrupted
+    run never leaves a half written output behind.
+    :return: (ok, elapsed seconds, error message)
+    """
+    _, muxer, resample, codec_args = OUTPUT_FORMATS[output_format]
+    if resample and sr is not None:
+        codec_args = codec_args + ['-ar', str(int(sr))]
+    part_path = output_path + PART_SUFFIX
+    command = ['ffmpeg', '-nostdin', '-y', '-loglevel', 'error', '-i', input_path, '-vn',
+               *codec_args, '-f', muxer, part_path]
+    start = time.time()
+    try:
+        try:
+            result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except OSError as e:
+            return False, time.time() - start, str(e)
+        if result.returncode != 0:
+            return False, time.time() - start, result.stderr.decode('utf-8', errors='replace').strip()
+        os.replace(part_path, output_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return True, time.time() - start, ''
+
+
+def _convert_file_star(args):
+    video_file, input_path, output_path, output_format, sr = args
+    return (video_file, os.path.getsize(input_path)) + convert_file(input_path, output_path, output_format, sr)
+
+
+def video_to_audio(video_folder, converted_folder, sr=None, output_format='mp3', workers=None):
+    """
+    :param sr: sample rate of the 'wav' and 'wav32' outputs, e.g. the analysis rate. None keeps the source rate
+    :param output_format: 'mp3', 'wav' (mono 16 bit PCM) or 'wav32' (mono float32)
+    :param workers: concurrent ffmpeg processes, cpu count by default
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Invalid Output Format : {output_format}")
+    extension = OUTPUT_FORMATS[output_format][0]
+    os.makedirs(converted_folder, exist_ok=True)
+
+    tasks = []
+    for video_file in sorted(os.listdir(video_folder)):
+        if video_file.endswith('.mp4') and not is_partial_file(video_file):
             file_name, _ = os.path.splitext(video_file)
             input_path = os.path.join(video_folder, video_file)
-            output_path = os.path.join(converted_folder, f'{file_name}.mp3')
+            output_path = os.path.join(converted_folder, f'{file_name}{extension}')
 
             if not os.path.exists(output_path):
-                command = f'ffmpeg -i "{input_path}" -vn -acodec libmp3lame -ac 2 -qscale:a 4 "{output_path}"'
-                subprocess.call(command, shell=True)
-                print(f'Converted: {video_file} to {file_name}.mp3')
+                tasks.append((video_file, input_path, output_path, output_format, sr))
+            else:
+                print(f'{file_name}{extension} already exists, skipped converting {video_file}')
+
+    if not tasks:
+        return
+
+    start = time.time()
+    converted, failed, input_bytes, ffmpeg_time = 0, 0, 0, 0.0
+    with ThreadPool(min(workers or os.cpu_count() or 1, len(tasks))) as pool:
+        for video_file, size, ok, elapsed, message in pool.imap_unordered(_convert_file_star, tasks):
+            ffmpeg_time += elapsed
+            if ok:
+                converted += 1
+                input_bytes += size
+                print(f'Converted: {video_file} to {output_format} in {elapsed:.2f}s')
             else:
-                print(f'{file_name}.mp3 already exists, skipped converting {video_file}')
+                failed += 1
+                print(f'Failed converting {video_file} after {elapsed:.2f}s: {message}')
+    wall = time.time() - start
+
+    print(f'Conversion done: {converted} converted, {failed} failed')
+    print(f'  wall {wall:.2f}s, sum of ffmpeg time {ffmpeg_time:.2f}s')
+    if wall > 0:
+        print(f'  throughput {converted / wall:.2f} files/s, {input_bytes / 1024 ** 2 / wall:.1f} MB/s of video')